@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Memory benchmark for nessus result items. Reports growth of peak process
+memory per finding for two cases:
+
+records     result items kept referenced, built with NessusXMLStream so
+            the parser does not hold the document tree. Versions without
+            the streaming parser use NessusXMLReport.
+parser      parsing with NessusXMLReport, which builds the whole tree
+
+Each case and package tree is measured in a separate python process. To
+compare against an earlier version, give the directory of a checkout of it
+as third argument, for example one created with
+
+    git worktree add /tmp/scanreports-baseline <commit>
+"""
+
+import os,sys,resource,subprocess,tempfile
+
+from synthetic import write_report
+
+def peak_memory():
+    """
+    Peak resident memory of this process in bytes (ru_maxrss is in
+    kilobytes on Linux)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+MEASUREMENTS = ['records','parser']
+
+def measure(measurement,path):
+    """
+    Return (findings,bytes per finding) for given measurement of the report
+    with the scanreports package found in sys.path
+    """
+    from scanreports import nessus
+    before = peak_memory()
+    results = []
+    if measurement == 'records' and hasattr(nessus,'NessusXMLStream'):
+        for host in nessus.NessusXMLStream(path):
+            results.extend(host)
+    else:
+        report = nessus.NessusXMLReport(path)
+        for r in report:
+            for host in r:
+                results.extend(host)
+    return (len(results),(peak_memory()-before)/len(results))
+
+def measure_tree(tree,measurement,path):
+    """
+    Run measure() in a new process with scanreports imported from tree
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([tree,os.path.dirname(os.path.abspath(__file__))])
+    output = subprocess.check_output(
+        [sys.executable,os.path.abspath(__file__),'--measure',measurement,path],
+        env=env,
+    )
+    (findings,size) = output.split()
+    return (int(findings),int(size))
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--measure':
+        print '%d %d' % measure(sys.argv[2],sys.argv[3])
+        sys.exit(0)
+
+    hosts = len(sys.argv) > 1 and int(sys.argv[1]) or 200
+    items = len(sys.argv) > 2 and int(sys.argv[2]) or 20
+    baseline = len(sys.argv) > 3 and sys.argv[3] or None
+    current = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    (fd,path) = tempfile.mkstemp(suffix='.nessus')
+    os.close(fd)
+    try:
+        write_report(path,hosts,items)
+        trees = [('current',current)]
+        if baseline is not None:
+            trees.insert(0,('baseline',baseline))
+        for (name,tree) in trees:
+            for measurement in MEASUREMENTS:
+                (findings,size) = measure_tree(tree,measurement,path)
+                print '%-8s %-7s %s: %d findings, %7d bytes per finding' % (
+                    name,measurement,tree,findings,size
+                )
+    finally:
+        os.unlink(path)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Parser micro-benchmark: measures converted ReportItems per second for a
+synthetic nessus report with the streaming parser.
+"""
+
+import os,sys,time,tempfile
+
+from scanreports.nessus import NessusXMLStream
+
+from synthetic import write_report
+
+def parse_rate(path,rounds=3):
+    """
+    Return (items,best items per second) for parsing given report
+    """
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        items = 0
+        for host in NessusXMLStream(path):
+            items += len(host)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (items,items/best)
+
+if __name__ == '__main__':
+    hosts = len(sys.argv) > 1 and int(sys.argv[1]) or 500
+    items = len(sys.argv) > 2 and int(sys.argv[2]) or 20
+
+    (fd,path) = tempfile.mkstemp(suffix='.nessus')
+    os.close(fd)
+    try:
+        write_report(path,hosts,items)
+        (count,rate) = parse_rate(path)
+    finally:
+        os.unlink(path)
+    print '%d ReportItems: %d ReportItems/second' % (count,rate)
+
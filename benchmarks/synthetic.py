@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Generator for synthetic nessus v2 XML reports used by the benchmarks
+"""
+
+import sys,random
+
+POLICY = """<Policy><policyName>Synthetic</policyName>
+<Preferences><ServerPreferences>
+<preference><name>max_hosts</name><value>30</value></preference>
+</ServerPreferences><PluginsPreferences>
+<item><pluginName>Ping the remote host</pluginName><pluginId>10180</pluginId>
+<fullName>Ping the remote host[checkbox]:Do a TCP ping</fullName>
+<preferenceName>Do a TCP ping</preferenceName><preferenceType>checkbox</preferenceType>
+<preferenceValues>yes</preferenceValues><selectedValue>yes</selectedValue></item>
+</PluginsPreferences></Preferences>
+<FamilySelection>
+<FamilyItem><FamilyName>Windows</FamilyName><Status>enabled</Status></FamilyItem>
+</FamilySelection>
+<IndividualPluginSelection>
+<PluginItem><PluginId>10180</PluginId><PluginName>Ping the remote host</PluginName>
+<Family>Port scanners</Family><Status>enabled</Status></PluginItem>
+</IndividualPluginSelection>
+</Policy>
+"""
+
+RISK_FACTORS = ['None','Low','Medium','High']
+PORTS = [0,22,80,139,443,445,3389]
+
+def host_address(index):
+    return '10.%d.%d.%d' % ((index>>16)&255,(index>>8)&255,index&255)
+
+def report_item(rnd,address,pid):
+    severity = pid % 4
+    port = rnd.choice(PORTS)
+    item = ['<ReportItem port="%d" svc_name="www" protocol="tcp" severity="%d" pluginID="%d" pluginName="Synthetic plugin %d" pluginFamily="Family %d">' % (
+        port,severity,pid,pid,pid%7
+    )]
+    item.append('<description>Description for plugin %d.\n\nThe remote service is affected by issue %d.</description>' % (pid,pid))
+    item.append('<plugin_modification_date>2011/01/%02d</plugin_modification_date>' % (pid%28+1))
+    item.append('<plugin_publication_date>2009/02/03</plugin_publication_date>')
+    item.append('<plugin_type>remote</plugin_type>')
+    item.append('<risk_factor>%s</risk_factor>' % RISK_FACTORS[severity])
+    item.append('<solution>Upgrade to version %d.</solution>' % pid)
+    item.append('<synopsis>Synopsis for plugin %d</synopsis>' % pid)
+    item.append('<plugin_version>$Revision: 1.%d $</plugin_version>' % (pid%50))
+    if severity > 0:
+        item.append('<cvss_base_score>%d.%d</cvss_base_score>' % (severity*3,pid%10))
+        item.append('<cvss_vector>CVSS2#AV:N/AC:L/Au:N/C:P/I:P/A:P</cvss_vector>')
+        item.append('<cve>CVE-2010-%04d</cve><cve>CVE-2011-%04d</cve>' % (pid%1000,pid%777))
+        item.append('<bid>%d</bid>' % pid)
+        item.append('<xref>OSVDB:%d</xref><xref>CWE:20</xref>' % pid)
+        item.append('<see_also>http://www.example.com/advisories/%d</see_also>' % pid)
+        item.append('<exploit_available>%s</exploit_available>' % (pid%3==0 and 'true' or 'false'))
+        item.append('<vuln_publication_date>2008/01/01</vuln_publication_date>')
+    item.append('<plugin_output>Detected on %s port %d\nversion : 1.%d\n</plugin_output>' % (
+        address,port,rnd.randint(0,9)
+    ))
+    item.append('</ReportItem>\n')
+    return ''.join(item)
+
+def write_report(path,hosts=100,items=20,plugins=500,seed=1):
+    """
+    Write a synthetic report with given number of hosts and report items
+    per host, using plugin IDs from a pool of given size.
+    """
+    rnd = random.Random(seed)
+    fd = open(path,'w')
+    fd.write('<?xml version="1.0" ?>\n<NessusClientData_v2>\n')
+    fd.write(POLICY)
+    fd.write('<Report name="Synthetic">\n')
+    for h in range(hosts):
+        address = host_address(h)
+        fd.write('<ReportHost name="%s"><HostProperties>' % address)
+        fd.write('<tag name="HOST_END">Thu Feb  3 10:11:22 2011</tag>')
+        fd.write('<tag name="host-ip">%s</tag>' % address)
+        fd.write('<tag name="netbios-name">HOST%d</tag>' % h)
+        fd.write('</HostProperties>\n')
+        for i in range(items):
+            fd.write(report_item(rnd,address,10000+rnd.randint(0,plugins-1)))
+        fd.write('</ReportHost>\n')
+    fd.write('</Report>\n</NessusClientData_v2>\n')
+    fd.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print 'usage: %s <path> [hosts] [items]' % sys.argv[0]
+        sys.exit(1)
+    write_report(sys.argv[1],*[int(x) for x in sys.argv[2:4]])
+
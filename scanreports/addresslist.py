@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Address list filtering with sorted integer intervals for IPv4 and IPv6
+"""
+
+import socket,struct
+from bisect import bisect_right
+
+from scanreports import ReportParserError
+from seine.address import IPv4Address,IPv6Address
+
+ADDRESS_FAMILIES = {
+    4: (socket.AF_INET,32),
+    6: (socket.AF_INET6,128),
+}
+
+def address_string(address):
+    """
+    Return string presentation of IPv4Address or IPv6Address object
+    """
+    if isinstance(address,IPv4Address):
+        return address.ipaddress
+    if isinstance(address,IPv6Address):
+        return address.address
+    return str(address)
+
+def parse_address(value):
+    """
+    Parse address or network string, IPv4Address or IPv6Address to tuple
+    (version,first,last) with first and last addresses as integers.
+    """
+    if isinstance(value,(IPv4Address,IPv6Address)):
+        value = '%s/%s' % (address_string(value),value.bitmask)
+    value = value.strip()
+    try:
+        (address,bitmask) = value.split('/')
+    except ValueError:
+        (address,bitmask) = (value,None)
+
+    for version,(family,bits) in ADDRESS_FAMILIES.items():
+        try:
+            packed = socket.inet_pton(family,address)
+        except (socket.error,ValueError):
+            continue
+        try:
+            if bitmask is None:
+                bitmask = bits
+            else:
+                bitmask = int(bitmask)
+        except ValueError:
+            raise ReportParserError('Invalid address: %s' % value)
+        if bitmask < 0 or bitmask > bits:
+            raise ReportParserError('Invalid address: %s' % value)
+        number = 0L
+        for word in struct.unpack('!%dI' % (bits/32),packed):
+            number = (number << 32) | word
+        hostmask = (1L << (bits-bitmask)) - 1
+        return (version,number &~ hostmask,number | hostmask)
+
+    raise ReportParserError('Invalid address: %s' % value)
+
+def address_value(address):
+    """
+    Return (version,integer) tuple for an address
+    """
+    (version,first,last) = parse_address(address_string(address))
+    return (version,first)
+
+class AddressIntervals(object):
+    """
+    Merged sorted address intervals by IP version, with binary search
+    membership tests
+    """
+    def __init__(self):
+        self.ranges = []
+        self.intervals = None
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def add(self,version,first,last):
+        self.ranges.append((version,first,last))
+        self.intervals = None
+
+    def compile(self):
+        """
+        Merge overlapping and adjacent ranges to sorted interval lists
+        """
+        self.intervals = dict((v,([],[])) for v in ADDRESS_FAMILIES.keys())
+        for (version,first,last) in sorted(self.ranges):
+            (starts,ends) = self.intervals[version]
+            if ends and first <= ends[-1]+1:
+                ends[-1] = max(ends[-1],last)
+                continue
+            starts.append(first)
+            ends.append(last)
+
+    def match(self,version,value):
+        if self.intervals is None:
+            self.compile()
+        (starts,ends) = self.intervals[version]
+        i = bisect_right(starts,value) - 1
+        return i >= 0 and value <= ends[i]
+
+class AddressFilter(object):
+    """
+    Address filter built from include and exclude lists of addresses and
+    networks. An address matches if it is in the include list, or the include
+    list is empty, and is not in the exclude list.
+
+    Membership tests with 'address in filter' are binary searches over merged
+    address intervals.
+    """
+    def __init__(self,include=[],exclude=[]):
+        self.include = AddressIntervals()
+        self.exclude = AddressIntervals()
+        self.cache = {}
+        for value in include:
+            self.add(value)
+        for value in exclude:
+            self.add(value,exclude=True)
+
+    def __len__(self):
+        return len(self.include) + len(self.exclude)
+
+    def __str__(self):
+        return '%d included %d excluded addresses' % (
+            len(self.include),len(self.exclude)
+        )
+
+    def add(self,value,exclude=False):
+        """
+        Add an address or network to include or exclude list
+        """
+        if exclude:
+            self.exclude.add(*parse_address(value))
+        else:
+            self.include.add(*parse_address(value))
+        self.cache.clear()
+
+    def add_file(self,path,exclude=False):
+        """
+        Add addresses and networks from a file, one per line. Empty lines and
+        lines starting with # are ignored.
+        """
+        try:
+            for line in open(path,'r').readlines():
+                line = line.strip()
+                if line == '' or line.startswith('#'):
+                    continue
+                self.add(line.split()[0],exclude)
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error reading address list %s: %s' % (
+                path,emsg
+            ))
+
+    def __contains__(self,address):
+        key = address_string(address)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        (version,value) = address_value(key)
+        if len(self.include) and not self.include.match(version,value):
+            matches = False
+        elif len(self.exclude) and self.exclude.match(version,value):
+            matches = False
+        else:
+            matches = True
+        self.cache[key] = matches
+        return matches
+
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Persistent cache for parsed report files. Parsed reports are pickled to a
+cache directory, keyed by the report file path, size, modification time and
+content hash, so reports are only parsed again when the file changes.
+
+References to lxml elements and trees in the parsed objects are not cached.
+"""
+
+import os,logging,hashlib,tempfile,cPickle
+from lxml import etree
+
+from scanreports import ReportParserError
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'),'.scanreports','cache')
+DEFAULT_CACHE_SIZE = 2**30
+
+# Increase when the cached classes change
+CACHE_FORMAT_VERSION = 3
+
+LXML_TYPES = (etree._Element,etree._ElementTree)
+
+def file_digest(path,blocksize=2**20):
+    """
+    Return SHA1 hex digest for file contents
+    """
+    digest = hashlib.sha1()
+    fd = open(path,'rb')
+    try:
+        while True:
+            data = fd.read(blocksize)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        fd.close()
+    return digest.hexdigest()
+
+class ReportCache(object):
+    """
+    Cache directory for parsed reports with a size limit. When the cache
+    grows over max_size bytes, least recently used entries are removed.
+    """
+    def __init__(self,path=DEFAULT_CACHE_DIR,max_size=DEFAULT_CACHE_SIZE):
+        self.log = logging.getLogger('modules')
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError,(ecode,emsg):
+                raise ReportParserError('Error creating cache directory %s: %s' % (
+                    self.path,emsg
+                ))
+
+    def __entry_path__(self,key):
+        return os.path.join(self.path,'%s.pickle' % key)
+
+    def key(self,path,name):
+        """
+        Return cache key for report file parsed with parser name
+        """
+        try:
+            st = os.stat(path)
+            digest = file_digest(path)
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error reading %s: %s' % (path,emsg))
+        return hashlib.sha1('\0'.join(str(x) for x in (
+            CACHE_FORMAT_VERSION,os.path.realpath(path),
+            st.st_size,st.st_mtime,digest,name,
+        ))).hexdigest()
+
+    def __contains__(self,key):
+        return key is not None and os.path.isfile(self.__entry_path__(key))
+
+    def get(self,key):
+        """
+        Return cached value for key, or None if not cached
+        """
+        path = self.__entry_path__(key)
+        try:
+            fd = open(path,'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                unpickler = cPickle.Unpickler(fd)
+                unpickler.persistent_load = lambda pid: None
+                value = unpickler.load()
+            finally:
+                fd.close()
+        except Exception,e:
+            self.log.debug('Removing invalid cache entry %s: %s' % (path,e))
+            self.remove(key)
+            return None
+        # Update access time for LRU eviction
+        try:
+            os.utime(path,None)
+        except OSError:
+            pass
+        return value
+
+    def put(self,key,value):
+        """
+        Store value to the cache, evicting old entries if needed
+        """
+        (fd,tmp) = tempfile.mkstemp(dir=self.path,suffix='.tmp')
+        try:
+            f = os.fdopen(fd,'wb')
+            try:
+                pickler = cPickle.Pickler(f,cPickle.HIGHEST_PROTOCOL)
+                pickler.persistent_id = lambda obj: \
+                    isinstance(obj,LXML_TYPES) and 'lxml' or None
+                pickler.dump(value)
+            finally:
+                f.close()
+            os.rename(tmp,self.__entry_path__(key))
+        except Exception,e:
+            if os.path.isfile(tmp):
+                os.unlink(tmp)
+            self.log.warning('Error caching %s: %s' % (key,e))
+            return
+        self.evict()
+
+    def remove(self,key):
+        try:
+            os.unlink(self.__entry_path__(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Remove least recently used entries until cache fits in max_size
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.pickle'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path,name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime,st.st_size,name))
+        total = sum(e[1] for e in entries)
+        for (mtime,size,name) in sorted(entries):
+            if total <= self.max_size:
+                break
+            self.log.debug('Evicting cache entry %s' % name)
+            try:
+                os.unlink(os.path.join(self.path,name))
+            except OSError:
+                continue
+            total -= size
+
+    def load(self,path,parser,name=None):
+        """
+        Return parser(path) from cache, parsing and caching it if needed.
+        The name identifies parser and its options in cache key, and defaults
+        to the parser module and name.
+        """
+        if name is None:
+            name = '%s.%s' % (parser.__module__,parser.__name__)
+        key = self.key(path,name)
+        value = self.get(key)
+        if value is None:
+            self.log.debug('Parsing %s' % path)
+            value = parser(path)
+            self.put(key,value)
+        else:
+            self.log.debug('Loaded %s from cache' % path)
+        return value
+
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Columnar table of nessus results for vectorized counts, sorting and
+grouping. Requires numpy, which is an optional dependency.
+"""
+
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from scanreports import ReportParserError
+from scanreports.addresslist import address_string,address_value
+
+# Integer columns with default value for missing fields
+INTEGER_COLUMNS = {
+    'pluginID': (numpy and numpy.int32,-1),
+    'severity': (numpy and numpy.int8,-1),
+    'port':     (numpy and numpy.int32,-1),
+}
+DECIMAL_COLUMNS = ['cvss_base_score','cvss_temporal_score']
+DATE_COLUMNS = [
+    'plugin_modification_date',
+    'plugin_publication_date',
+    'vuln_publication_date',
+    'patch_publication_date',
+]
+BOOLEAN_COLUMNS = [
+    'exploit_available',
+    'exploit_framework_metasploit',
+    'exploit_framework_canvas',
+    'exploit_framework_core',
+]
+STRING_COLUMNS = ['protocol','svc_name','pluginName','pluginFamily','risk_factor']
+
+# Columns which can be grouped by with original field values as keys
+GROUPED_COLUMNS = INTEGER_COLUMNS.keys() + STRING_COLUMNS + ['address']
+
+def decimal_tenths(value):
+    """
+    Return decimal score multiplied by 10 as integer, -1 if missing
+    """
+    if value is None:
+        return -1
+    return int(value*10)
+
+def boolean_state(value):
+    """
+    Return boolean as 1 or 0, -1 if missing. Missing values sort before
+    False like None in result_sort_key.
+    """
+    if value is None:
+        return -1
+    return value and 1 or 0
+
+def date_ordinal(dates):
+    """
+    Return ordinal of first date in a tuple of time.struct_time, 0 if empty
+    """
+    if not dates:
+        return 0
+    return datetime.date(*dates[0][:3]).toordinal()
+
+class NessusFindingTable(object):
+    """
+    Columnar copy of nessus results. Each column is a numpy array with one
+    value per result:
+
+    pluginID,severity,port  integers, -1 if missing
+    address                 rank of the address string in sorted table
+    cvss_*                  CVSS scores multiplied by 10, -1 if missing
+    *_date                  date ordinals of first date, 0 if missing
+    exploit*                1 for True, 0 for False, -1 if missing
+    protocol,svc_name etc.  codes to string tables in self.strings
+
+    The original result objects are returned with materialise().
+    """
+    def __init__(self,results):
+        if numpy is None:
+            raise ReportParserError('Columnar result tables require numpy')
+
+        self.results = list(results)
+        self.columns = {}
+        self.strings = {}
+        count = len(self.results)
+
+        for field,(dtype,default) in INTEGER_COLUMNS.items():
+            self.columns[field] = numpy.fromiter(
+                (r.get(field,default) for r in self.results),dtype,count
+            )
+        for field in DECIMAL_COLUMNS:
+            self.columns[field] = numpy.fromiter(
+                (decimal_tenths(r.get(field)) for r in self.results),
+                numpy.int16,count
+            )
+        for field in DATE_COLUMNS:
+            self.columns[field] = numpy.fromiter(
+                (date_ordinal(r.get(field)) for r in self.results),
+                numpy.int32,count
+            )
+        for field in BOOLEAN_COLUMNS:
+            self.columns[field] = numpy.fromiter(
+                (boolean_state(r.get(field)) for r in self.results),
+                numpy.int8,count
+            )
+        for field in STRING_COLUMNS:
+            (self.strings[field],self.columns[field]) = self.__encode__(
+                [r.get(field) for r in self.results]
+            )
+
+        # Addresses are coded by rank in sorted table of address strings.
+        # IPv6Address objects are not hashable, so strings are returned.
+        keys = sorted(set(address_string(r.address) for r in self.results),
+            key=address_value
+        )
+        ranks = dict((key,i) for i,key in enumerate(keys))
+        self.strings['address'] = keys
+        self.columns['address'] = numpy.fromiter(
+            (ranks[address_string(r.address)] for r in self.results),
+            numpy.int32,count
+        )
+
+    def __encode__(self,values):
+        """
+        Encode values to sorted string table and array of codes
+        """
+        table = sorted(set(values))
+        codes = dict((v,i) for i,v in enumerate(table))
+        return (table,numpy.fromiter(
+            (codes[v] for v in values),numpy.int32,len(values)
+        ))
+
+    def __len__(self):
+        return len(self.results)
+
+    def column(self,field):
+        try:
+            return self.columns[field]
+        except KeyError:
+            raise ReportParserError('No such column: %s' % field)
+
+    def value(self,field,code):
+        """
+        Return original value for a column value, decoding string codes
+        and boolean states
+        """
+        if field in self.strings:
+            return self.strings[field][code]
+        if field in BOOLEAN_COLUMNS:
+            if code < 0:
+                return None
+            return bool(code)
+        return code
+
+    def counters(self):
+        """
+        Return counts of results by severity
+        """
+        counts = numpy.bincount(
+            self.columns['severity'][self.columns['severity']>=0],minlength=4
+        )
+        return dict((i,int(c)) for i,c in enumerate(counts))
+
+    def histogram(self,field):
+        """
+        Return dictionary of result counts by field value
+        """
+        (values,counts) = numpy.unique(self.column(field),return_counts=True)
+        return dict(
+            (self.value(field,v),int(c)) for v,c in zip(values.tolist(),counts)
+        )
+
+    def sort_keys(self,*fields):
+        """
+        Return list of sort key arrays for fields, with - prefix for
+        descending order
+        """
+        keys = []
+        for field in fields:
+            if field.startswith('-'):
+                keys.append(-self.column(field[1:]).astype(numpy.int64))
+            else:
+                keys.append(self.column(field))
+        return keys
+
+    def argsort(self,*fields):
+        """
+        Return stable sort order of results by fields
+        """
+        keys = self.sort_keys(*fields)
+        if not keys:
+            return numpy.arange(len(self))
+        # lexsort uses last key as primary key
+        return numpy.lexsort(keys[::-1])
+
+    def order_by(self,*fields):
+        return self.materialise(self.argsort(*fields))
+
+    def top(self,limit,*fields):
+        """
+        Return first limit results ordered by fields. Only rows with primary
+        key within the limit are sorted.
+        """
+        keys = self.sort_keys(*fields)
+        if not keys or limit >= len(self):
+            return self.materialise(self.argsort(*fields)[:limit])
+        if limit <= 0:
+            return []
+        kth = numpy.partition(keys[0],limit-1)[limit-1]
+        rows = numpy.flatnonzero(keys[0] <= kth)
+        order = numpy.lexsort([key[rows] for key in keys[::-1]])
+        return self.materialise(rows[order][:limit])
+
+    def group_by(self,field):
+        """
+        Return dictionary of field value to results in original order
+        """
+        column = self.column(field)
+        order = numpy.argsort(column,kind='mergesort')
+        values = column[order]
+        bounds = numpy.flatnonzero(numpy.diff(values)) + 1
+        groups = {}
+        for indices in numpy.split(order,bounds):
+            if len(indices):
+                value = self.value(field,column[indices[0]].item())
+                groups[value] = self.materialise(indices)
+        return groups
+
+    def select(self,mask):
+        """
+        Return results matching a boolean mask over the columns
+        """
+        return self.materialise(numpy.flatnonzero(mask))
+
+    def materialise(self,indices):
+        """
+        Return result objects for row indices
+        """
+        return [self.results[i] for i in indices]
+
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Differences of nessus results between scans. Findings are matched by a
+fingerprint of address, port, protocol and plugin ID, optionally with a hash
+of the normalized plugin output.
+"""
+
+import re,hashlib,logging
+
+from scanreports import ReportParserError
+from scanreports.addresslist import address_string
+from scanreports.nessus import NessusResultSet
+
+DELTA_CATEGORIES = ['new','resolved','unchanged']
+
+WHITESPACE = re.compile(r'\s+')
+
+def output_digest(value):
+    """
+    Return SHA1 digest of plugin output with whitespace normalized
+    """
+    if value is None:
+        return None
+    if isinstance(value,unicode):
+        value = value.encode('utf-8')
+    return hashlib.sha1(WHITESPACE.sub(' ',value).strip()).digest()
+
+def result_fingerprint(result,compare_output=False):
+    """
+    Return fingerprint tuple identifying a finding between scans
+    """
+    fingerprint = (
+        address_string(result.address),
+        result.port,
+        result.protocol,
+        result.pluginID,
+    )
+    if compare_output:
+        fingerprint += (output_digest(result.get('plugin_output')),)
+    return fingerprint
+
+class NessusResultDelta(object):
+    """
+    Delta of current results against baseline results, computed in one
+    hash join pass. Baseline results are kept in a fingerprint table, and
+    current results can be any iterable, for example a generator over
+    parsed reports.
+
+    Results are collected to result sets new, resolved and unchanged for
+    categories in keep, other categories are only counted.
+    """
+    def __init__(self,baseline,current,compare_output=False,keep=DELTA_CATEGORIES):
+        self.log = logging.getLogger('modules')
+        self.compare_output = compare_output
+        for category in keep:
+            if category not in DELTA_CATEGORIES:
+                raise ReportParserError('Invalid delta category: %s' % category)
+        self.counts = dict((category,0) for category in DELTA_CATEGORIES)
+        self.new = NessusResultSet()
+        self.resolved = NessusResultSet()
+        self.unchanged = NessusResultSet()
+
+        pending = {}
+        for r in baseline:
+            pending.setdefault(self.fingerprint(r),[]).append(r)
+
+        for r in current:
+            matches = pending.get(self.fingerprint(r))
+            if matches:
+                category = 'unchanged'
+                matches.pop()
+            else:
+                category = 'new'
+            self.counts[category] += 1
+            if category in keep:
+                getattr(self,category).append(r)
+
+        for matches in pending.values():
+            self.counts['resolved'] += len(matches)
+            if 'resolved' in keep:
+                self.resolved.extend(matches)
+
+        for category in DELTA_CATEGORIES:
+            results = getattr(self,category)
+            for r in results:
+                results.plugin_details.merge(r.plugin)
+            results.reindex()
+        self.log.debug('Scan delta: %s' % self)
+
+    def __str__(self):
+        return ' '.join('%s %d' % (c,self.counts[c]) for c in DELTA_CATEGORIES)
+
+    def fingerprint(self,result):
+        return result_fingerprint(result,self.compare_output)
+
+def scan_deltas(scans,compare_output=False,keep=DELTA_CATEGORIES):
+    """
+    Return list of NessusResultDelta objects between consecutive scans
+    """
+    scans = list(scans)
+    return [NessusResultDelta(baseline,current,compare_output,keep)
+        for baseline,current in zip(scans[:-1],scans[1:])
+    ]
+
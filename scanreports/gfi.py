@@ -76,7 +76,8 @@ class GFIScanAttributes(dict):
             return self[attr]
         except KeyError:
             pass
- 
+        raise AttributeError('No such attribute: %s' % attr)
+
 class GFIScannedHost(dict):
     def __init__(self,report,node):
         self.report = report
@@ -132,11 +133,13 @@ class GFIInstalledApp(dict):
             return self[attr]
         except KeyError:
             pass
+        raise AttributeError('No such attribute: %s' % attr)
  
 class GFILanguardSummary(dict):
-    def __init__(self):
+    def __init__(self,cache=None):
         self.reports = []
         self.noapps = []
+        self.cache = cache
         self.log = logging.getLogger('modules')
 
     def __getattr__(self,attr):
@@ -145,7 +148,10 @@ class GFILanguardSummary(dict):
         raise AttributeError('No such GFILanguardSummary attribute: %s' % attr)
 
     def read(self,path):
-        report = GFILanguardReport(path)
+        if self.cache is not None:
+            report = self.cache.load(path,GFILanguardReport)
+        else:
+            report = GFILanguardReport(path)
         for host in report:
             if host.address in self.hosts:
                 self.log.debug('Duplicate report for IP %s' % host.address)
@@ -79,11 +79,12 @@ class MBSAAdvice(dict):
         self.check = check
         self.node = node
 
+        self.text = self.node.text
         for k,v in self.node.items():
             self[k.lower()] = v
 
     def __str__(self):
-        return self.node.text
+        return self.text
 
 class MBSACheckDetail(dict):
     def __init__(self,check,node):
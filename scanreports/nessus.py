@@ -3,10 +3,16 @@
 Parser for nessus XML report files
 """
 
-import os,logging,sys,time,re,decimal,socket
+import os,logging,sys,time,re,decimal,heapq,multiprocessing
 from lxml import etree
 
 from scanreports import ReportParserError
+from scanreports.addresslist import AddressFilter,address_string,address_value
+from scanreports.resolver import HostResolver
+from scanreports.pluginfilter import NessusPluginFilter
+from scanreports.references import NessusReferenceIndex
+from scanreports.textindex import NessusTextIndex,TEXT_INDEX_FIELDS,text_pattern,text_value
+from scanreports.columnar import NessusFindingTable,GROUPED_COLUMNS
 from seine.address import IPv4Address,IPv6Address
 
 SEVERITY_NAMES = ['Info','Low','Medium','High']
@@ -14,6 +20,16 @@ SEVERITY_NAMES = ['Info','Low','Medium','High']
 NESSUS_REPORT_FORMATS = [
     'NessusClientData_v2'
 ]
+# Policy sections not parsed with reports, with item tags in the sections
+NESSUS_POLICY_SECTIONS = {
+    'Preferences':                  ('preference','item'),
+    'FamilySelection':              ('FamilyItem',),
+    'IndividualPluginSelection':    ('PluginItem',),
+}
+NESSUS_POLICY_ITEMS = tuple(set(
+    tag for tags in NESSUS_POLICY_SECTIONS.values() for tag in tags
+))
+
 NESSUS_PLUGIN_REVISION_MATCHES = [
     re.compile('^\$Revision:\s+(.*)\s+\$$'),
     re.compile('^([0-9.]+)$'),
@@ -49,75 +65,400 @@ REPORT_SINGLE_STRING_VALUES = [
     'metasploit_name',
     'canvas_package',
 ]
+REPORT_ATTRIBUTE_VALUES = [
+    'port',
+    'svc_name',
+    'protocol',
+    'severity',
+    'pluginID',
+    'pluginName',
+    'pluginFamily',
+]
+REPORT_PARSED_STRING_VALUES = [
+    'plugin_version',
+    'plugin_type',
+    'solution',
+    'risk_factor',
+]
+
+# Fields indexed by NessusResultSet
+NESSUS_RESULT_INDEXES = ['pluginID','address','severity','port']
+
+# Per-instance fields of results, stored in NessusTargetResultItem
+REPORT_INSTANCE_VALUES = ['plugin_output']
+REPORT_INSTANCE_FIELDS = (
+    'name','address','port','svc_name','protocol','severity','pluginID',
+) + tuple(REPORT_INSTANCE_VALUES)
+
+# Plugin metadata fields, shared by results in NessusPluginDetails
+REPORT_PLUGIN_FIELDS = ('pluginID','xref_urls') + tuple(sorted(set(
+    REPORT_ATTRIBUTE_VALUES + REPORT_INT_VALUES + REPORT_DECIMAL_VALUES +\
+    REPORT_DATE_VALUES + REPORT_BOOLEAN_VALUES + REPORT_TEXT_VALUES +\
+    REPORT_REFERENCE_FIELDS + REPORT_SINGLE_STRING_VALUES +\
+    REPORT_PARSED_STRING_VALUES
+).difference(REPORT_INSTANCE_FIELDS)))
+
+def parse_host_address(value):
+    """
+    Return IPv4Address or IPv6Address for value, None if value is not an
+    IPv4 or IPv6 address
+    """
+    try:
+        return IPv4Address(value)
+    except ValueError:
+        pass
+    try:
+        return IPv6Address(value)
+    except ValueError:
+        return None
+
+def parse_policy_section(path,section):
+    """
+    Iterate items in a policy section of nessus report file as dictionaries
+    of child element tag to text. Parsing stops at end of the section.
+    """
+    tags = NESSUS_POLICY_SECTIONS[section]
+    try:
+        for (event,node) in etree.iterparse(path,tag=tags+(section,)):
+            if node.tag == section:
+                break
+            item = dict((n.tag,n.text) for n in node.getchildren())
+            item['tag'] = node.tag
+            yield item
+            node.clear()
+    except etree.XMLSyntaxError,e:
+        raise ReportParserError('Error parsing %s: %s' % (path,e))
+
+class NessusPolicy(object):
+    """
+    Policy sections of a nessus report file. The sections are skipped when
+    reports are parsed, and parsed from the file when first accessed.
+    """
+    def __policy_section__(self,attr,section,cls):
+        try:
+            return self.__dict__[attr]
+        except KeyError:
+            pass
+        self.__dict__[attr] = cls(parse_policy_section(self.path,section))
+        return self.__dict__[attr]
+
+    @property
+    def preferences(self):
+        return self.__policy_section__(
+            '_preferences','Preferences',NessusReportPreferences
+        )
 
-class NessusXMLReport(list):
-    def __init__(self,path):
+    @property
+    def target_families(self):
+        return self.__policy_section__(
+            '_target_families','FamilySelection',NessusTargetFamilies
+        )
+
+    @property
+    def plugins(self):
+        return self.__policy_section__(
+            '_plugins','IndividualPluginSelection',NessusPluginList
+        )
+
+# Number of ReportHost elements buffered by NessusXMLStream to resolve host
+# names of the chunk concurrently
+NESSUS_STREAM_CHUNK_HOSTS = 64
+
+def unresolved_host_names(nodes):
+    """
+    Return names of ReportHost nodes which are not addresses, for hosts
+    without host-ip property
+    """
+    return [name for name in [
+        node.get('name') for node in nodes
+        if node.find("HostProperties/tag[@name='host-ip']") is None
+    ] if name is not None and parse_host_address(name) is None]
+
+class NessusXMLReport(list,NessusPolicy):
+    def __init__(self,path,strict=True,resolver=None,plugin_filter=None):
         if not os.path.isfile(path):
             raise ReportParserError('No such file: %s' % path)
 
         self.path = path
+        self.strict = strict
+        self.plugin_filter = plugin_filter
+        if resolver is None:
+            resolver = HostResolver()
+        self.resolver = resolver
+        self.plugin_details = NessusPluginDetailsTable()
         try:
-            self.tree = etree.parse(path)
+            # Policy items are dropped while parsing, see NessusPolicy
+            context = etree.iterparse(path,tag=NESSUS_POLICY_ITEMS)
+            for (event,node) in context:
+                node.clear()
+                while node.getprevious() is not None:
+                    del node.getparent()[0]
+            root = context.root
         except etree.XMLSyntaxError,e:
             raise ReportParserError('Error parsing %s: %s' % (self.path,e))
 
-        root = self.tree.getroot()
         if root.tag not in NESSUS_REPORT_FORMATS:
             raise ReportParserError('Unsupported nessus report format: %s' % root.tag) 
 
-        self.preferences = NessusReportPreferences(self.tree.find('Preferences'))
-        self.target_families = NessusTargetFamilies(self.tree.find('FamilySelection'))
-        self.plugins = NessusPluginList(self.tree.find('IndividualPluginSelection'))
-
-        for node in self.tree.findall('Report'):
+        # The tree is not referenced after the records are built
+        for node in root.findall('Report'):
             # May raise ReportParserError 
             self.append(NessusReport(self,node))
 
     def __str__(self):
         return '%s: %d reports' % (self.path,len(self))
 
+    def results(self):
+        """
+        Iterate result items for all reports and hosts in the file
+        """
+        for report in self:
+            for host in report:
+                for result in host:
+                    yield result
+
+class NessusXMLStream(NessusPolicy):
+    """
+    Streaming reader for nessus XML reports. Instead of keeping the whole
+    document tree in memory, ReportHost elements are converted in chunks of
+    NESSUS_STREAM_CHUNK_HOSTS hosts and cleared from the tree after
+    processing. Host names of each chunk are resolved concurrently.
+
+    If plugin_filter is given, filtered ReportItem elements are skipped
+    without parsing them.
+    """
+    def __init__(self,path,strict=True,resolver=None,plugin_filter=None):
+        if not os.path.isfile(path):
+            raise ReportParserError('No such file: %s' % path)
+        self.path = path
+        self.strict = strict
+        self.plugin_filter = plugin_filter
+        if resolver is None:
+            resolver = HostResolver()
+        self.resolver = resolver
+        self.plugin_details = NessusPluginDetailsTable()
+
+    def __iter__(self):
+        """
+        Iterate NessusTargetHost objects in the file
+        """
+        report = None
+        hosts = []
+        try:
+            for (event,node) in etree.iterparse(self.path,events=('start','end')):
+                if event == 'start':
+                    if node.getparent() is None and node.tag not in NESSUS_REPORT_FORMATS:
+                        raise ReportParserError(
+                            'Unsupported nessus report format: %s' % node.tag
+                        )
+                    if node.tag == 'Report':
+                        report = NessusReport(self,node,parse_hosts=False)
+                    continue
+
+                if node.tag == 'ReportHost':
+                    hosts.append(node)
+                    if len(hosts) < NESSUS_STREAM_CHUNK_HOSTS:
+                        continue
+                elif node.tag not in ('Policy','Report') + NESSUS_POLICY_ITEMS:
+                    continue
+
+                if hosts:
+                    self.resolver.prefetch(unresolved_host_names(hosts))
+                    for host in hosts:
+                        # May raise ReportParserError
+                        target = NessusTargetHost(report,host)
+                        if target.address is not None:
+                            yield target
+                        host.clear()
+                    hosts = []
+
+                # Drop processed element and already processed siblings
+                node.clear()
+                while node.getprevious() is not None:
+                    del node.getparent()[0]
+
+        except etree.XMLSyntaxError,e:
+            raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+
+    def __str__(self):
+        return '%s: streaming report' % self.path
+
+    def results(self):
+        """
+        Iterate result items for all hosts in the file
+        """
+        for host in self:
+            for result in host:
+                yield result
+
+class NessusResultList(list):
+    """
+    List of results parsed from a report file, as returned by the worker
+    processes of parse_reports
+    """
+    def __init__(self,path,results=[]):
+        list.__init__(self,results)
+        self.path = path
+
+    def __str__(self):
+        return '%s: %d results' % (self.path,len(self))
+
+    def results(self):
+        return iter(self)
+
+def parse_report_results(args):
+    """
+    Parse results from a report file in a worker process. Returns tuple
+    (NessusResultList,names resolved by the worker)
+    """
+    (path,strict,resolver_options,plugin_filter) = args
+    resolver = HostResolver(**resolver_options)
+    results = NessusResultList(path,NessusXMLStream(path,
+        strict=strict,resolver=resolver,plugin_filter=plugin_filter
+    ).results())
+    return (results,dict(resolver))
+
+def parse_reports(paths,jobs=1,strict=True,resolver=None,cache=None,plugin_filter=None):
+    """
+    Iterate parsed report files for NessusResultSet.load. With jobs set to
+    1 files are streamed in this process, otherwise files are parsed with a
+    pool of jobs worker processes (None for one per CPU) and results for each
+    file are returned as NessusResultList, in the order of paths.
+
+    Names resolved by workers are merged to the resolver. If a ReportCache is
+    given, results are loaded from the cache when available and parsed
+    results are stored to it. Results filtered by a NessusPluginFilter given
+    as plugin_filter are not parsed.
+    """
+    if resolver is None:
+        resolver = HostResolver()
+    for path in paths:
+        if not os.path.isfile(path):
+            raise ReportParserError('No such file: %s' % path)
+
+    keys = {}
+    if cache is not None:
+        name = 'NessusResultList strict=%s filter=%s' % (
+            strict,plugin_filter is not None and plugin_filter.digest() or None
+        )
+        for path in paths:
+            keys[path] = cache.key(path,name)
+    pending = [path for path in paths if cache is None or keys[path] not in cache]
+
+    def parse(path):
+        stream = NessusXMLStream(path,
+            strict=strict,resolver=resolver,plugin_filter=plugin_filter
+        )
+        if cache is not None:
+            return NessusResultList(path,stream.results())
+        return stream
+
+    if jobs == 1 or len(pending) < 2:
+        pool = None
+        parsed = iter(parse(path) for path in pending)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        parsed = pool.imap(parse_report_results,
+            [(path,strict,resolver.options(),plugin_filter) for path in pending]
+        )
+
+    try:
+        for path in paths:
+            if path not in pending:
+                results = cache.get(keys[path])
+                if results is None:
+                    results = parse(path)
+                    cache.put(keys[path],results)
+                yield results
+                continue
+
+            results = parsed.next()
+            if pool is not None:
+                (results,names) = results
+                resolver.merge(names)
+            if cache is not None:
+                cache.put(keys[path],results)
+            yield results
+
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
 class NessusReport(list):
-    def __init__(self,master,node):
+    def __init__(self,master,node,parse_hosts=True):
         self.master = master
-        self.node = node
         self.name = node.get('name')
+        self.plugin_details = master.plugin_details
+        self.strict = master.strict
+        self.resolver = master.resolver
+        self.plugin_filter = master.plugin_filter
 
-        for node in self.node.findall('ReportHost'):
+        if not parse_hosts:
+            return
+
+        # Resolve host names without host-ip property concurrently
+        hosts = node.findall('ReportHost')
+        self.resolver.prefetch(unresolved_host_names(hosts))
+
+        for host in hosts:
             # May raise ReportParserError
-            self.append(NessusTargetHost(self,node))
+            target = NessusTargetHost(self,host)
+            if target.address is not None:
+                self.append(target)
+            host.clear()
 
     def __str__(self):
         return '%s: %d hosts' % (self.name,len(self))
 
 class NessusTargetHost(list):
+    """
+    Results for a ReportHost. If the host name can't be resolved to an
+    address, a warning is logged and address is None without results, and
+    the host is skipped by the parsers.
+    """
     def __init__(self,report,node):
         self.report = report
-        self.node = node
-        self.address = node.get('name')
+        self.name = node.get('name')
         self.properties = NessusTargetHostProperties(node.find('HostProperties'))
 
-        if self.address is None:
+        if self.name is None:
             raise ReportParserError('No address')
-        try:
-            self.address = IPv4Address(self.address)
-        except ValueError:
-            try:
-                self.address = IPv6Address(self.address)
-            except ValueError:
-                self.address = IPv4Address(socket.gethostbyaddr(self.address)[2][0])
+        self.address = parse_host_address(self.name)
+        if self.address is None:
+            address = report.resolver.resolve(self.name,self.properties)
+            if address is not None:
+                self.address = parse_host_address(address)
+            if self.address is None:
+                logging.getLogger('modules').warning(
+                    'Could not resolve address for %s, skipping host' % self.name
+                )
+                return
 
         try:
-            for i in self.node.findall('ReportItem'):
-                self.append(NessusTargetResultItem(self,i))
+            for i in node.findall('ReportItem'):
+                if report.plugin_filter is not None and \
+                   report.plugin_filter.match_node(i,self.address):
+                    continue
+                self.append(NessusTargetResultItem(
+                    self,i,report.plugin_details,report.strict
+                ))
         except ReportParserError,e:
             raise ReportParserError('Error parsing %s: %s' % (self.address,e))
 
     def __str__(self):
         return '%s %d results' % (self.address,len(self))
 
+    def __getstate__(self):
+        # The report and parser are not pickled with hosts
+        state = dict(self.__dict__)
+        state['report'] = None
+        return state
+
 class NessusTargetHostProperties(dict):
     def __init__(self,node):
-        self.node = node
         self.name = node.get('name')
         self.update( dict(
             [(t.get('name').lower(),t.text) for t in node.getchildren()]
@@ -129,105 +470,219 @@ class NessusTargetHostProperties(dict):
         else:
             return '<NO IP> %d properties' % len(self.keys())
 
-class NessusTargetResultItem(dict):
-    def __init__(self,host,node):
-        self.host = host
-        self.node = node
-        self.name = node.get('name')
-        self.update(node.items())
+def intern_value(value):
+    """
+    Intern repeated short string values to share them between results
+    """
+    if type(value) == str:
+        return intern(value)
+    return value
+
+class MemoizedConverter(dict):
+    """
+    Field value converter caching the converted values, for values repeated
+    in many report items like dates and plugin revisions
+    """
+    def __init__(self,converter,maxsize=10000):
+        self.converter = converter
+        self.maxsize = maxsize
+
+    def __call__(self,value):
+        try:
+            return self[value]
+        except KeyError:
+            pass
+        if len(self) >= self.maxsize:
+            self.clear()
+        converted = self[value] = self.converter(value)
+        return converted
+
+def convert_decimal(value):
+    try:
+        return decimal.Decimal(value)
+    except decimal.InvalidOperation:
+        raise ValueError('Invalid decimal value: %s' % value)
 
-        for k in filter(lambda k: self.has_key(k), REPORT_INT_VALUES):
+def convert_text(value):
+    return '\n'.join(l for l in value.split('\n') if l.strip() != '')
+
+def convert_dates(value):
+    return tuple(time.strptime(d,'%Y/%m/%d') for d in value.split())
+
+def convert_boolean(value):
+    return value.lower() in ['true','yes']
+
+def convert_plugin_version(value):
+    for rev in NESSUS_PLUGIN_REVISION_MATCHES:
+        m = rev.match(value)
+        if m:
+            return intern_value(m.group(1))
+    raise ValueError('Unknown plugin version %s' % value)
+
+def convert_plugin_type(value):
+    if value not in NESSUS_PLUGIN_TYPES:
+        raise ValueError('Unknown plugin types: %s' % value)
+    return intern_value(value)
+
+def convert_solution(value):
+    if value.lower() in ['n/a','']:
+        return None
+    return value
+
+def convert_risk_factor(value):
+    if value in ['None','']:
+        return None
+    return intern_value(value)
+
+# How converted child values are stored to records
+FIELD_SET,FIELD_APPEND,FIELD_SINGLE = range(3)
+
+def report_field_converters():
+    """
+    Build dispatch table of ReportItem child tag to (converter,mode)
+    """
+    converters = {}
+    for tag in REPORT_INT_VALUES:
+        converters[tag] = (int,FIELD_SET)
+    for tag in REPORT_DECIMAL_VALUES:
+        converters[tag] = (MemoizedConverter(convert_decimal),FIELD_SET)
+    for tag in REPORT_TEXT_VALUES:
+        converters[tag] = (convert_text,FIELD_SET)
+    for tag in REPORT_DATE_VALUES:
+        converters[tag] = (MemoizedConverter(convert_dates),FIELD_SET)
+    for tag in REPORT_BOOLEAN_VALUES:
+        converters[tag] = (convert_boolean,FIELD_SET)
+    for tag in REPORT_REFERENCE_FIELDS:
+        converters[tag] = (intern_value,FIELD_APPEND)
+    for tag in REPORT_SINGLE_STRING_VALUES:
+        converters[tag] = (intern_value,FIELD_SINGLE)
+    converters['plugin_version'] = (MemoizedConverter(convert_plugin_version),FIELD_SET)
+    converters['plugin_type'] = (convert_plugin_type,FIELD_SET)
+    converters['solution'] = (convert_solution,FIELD_SET)
+    converters['risk_factor'] = (convert_risk_factor,FIELD_SET)
+    return converters
+
+REPORT_FIELD_CONVERTERS = report_field_converters()
+
+class NessusRecord(object):
+    """
+    Base class for compact nessus records. Values are stored in slots listed
+    in __fields__, the lxml nodes are not referenced after conversion.
+    Fields not present in the report are not set, and unknown ReportItem
+    attributes are stored to the extra dictionary.
+
+    Dictionary style access (r['port'], r.has_key('cve')) is supported.
+    """
+    __slots__ = ('extra',)
+    __fields__ = ()
+
+    def __parse_attribute__(self,k,v):
+        if k in REPORT_INT_VALUES:
             try:
-                self[k] = int(self[k])
+                v = int(v)
             except ValueError:
-                raise ReportParserError('Invalid integer value: %s' % self[k])
-
-        for n in node.getchildren():
-            if n.tag in REPORT_INT_VALUES:
-                try:
-                   self[n.tag] = int(n.text)
-                except ValueError:
-                    raise ReportParserError('Invalid integer value %s: %s' %
-                        n.tag,n.text
-                    )
-        
-            elif n.tag in REPORT_DECIMAL_VALUES:
-                try:
-                    self[n.tag] = decimal.Decimal(n.text)
-                except ValueError:
-                    raise ReportParserError('Invalid decimal value %s: %s' % (
-                        n.tag,n.text
-                    ))
-
-            elif n.tag in REPORT_TEXT_VALUES:
-                self[n.tag] = []
-                for l in n.text.split('\n'):
-                    if l.strip() == '':
-                        continue
-                    self[n.tag].append(l)
-
-            elif n.tag in REPORT_DATE_VALUES:
-                dates = []
-                for d in filter(lambda d: d.strip(), n.text.split()):
-                    try:
-                        dates.append(time.strptime(d,'%Y/%m/%d'))
-                    except ValueError,e:
-                        raise ReportParserError('Invalid date %s: %s' % (k,d))
-                self[n.tag] = dates
-
-            elif n.tag in REPORT_BOOLEAN_VALUES:
-                if n.text.lower() in ['true','yes']:
-                    self[n.tag] = True
-                else:
-                    self[n.tag] = False
-                
-            elif n.tag == 'plugin_version':
-                plugin_version = None
-                for rev in NESSUS_PLUGIN_REVISION_MATCHES:
-                    m = rev.match(n.text)
-                    if not m:
-                        continue
-                    plugin_version = m.group(1)
-                    break
-                if plugin_version is None:
-                    raise ReportParserError('Unknown plugin version %s' % pv)
-                self['plugin_version'] = plugin_version
-
-            elif n.tag == 'plugin_type':
-                if n.text not in NESSUS_PLUGIN_TYPES:
-                    raise ReportParserError('Unknown plugin types: %s' % n.text)
-                self[n.tag] = n.text
-
-            elif n.tag == 'solution':
-                if n.text.lower() in ['n/a','']:
-                    self['solution'] = None
-                else:
-                    self['solution'] = n.text
-
-            elif n.tag == 'risk_factor':
-                if n.text in ['None','']:
-                    self[n.tag] = None
-                else:
-                    self[n.tag] = n.text
-
-            elif n.tag in REPORT_REFERENCE_FIELDS:
-                if not self.has_key(n.tag):
-                    self[n.tag] = []
-                self[n.tag].append(n.text)
-
-            elif n.tag in REPORT_SINGLE_STRING_VALUES:
-                if self.has_key(n.tag):
-                    raise ReportParserErro('Multiple targets for %s' % n.tag)
-                self[n.tag] = n.text
+                raise ReportParserError('Invalid integer value: %s' % v)
+        else:
+            v = intern_value(v)
+        self[k] = v
 
-            else:
+    def __parse_child__(self,n,strict=True):
+        text = n.text or ''
+        try:
+            (converter,mode) = REPORT_FIELD_CONVERTERS[n.tag]
+        except KeyError:
+            if strict:
                 raise ReportParserError('Unprocessed report field %s: %s' % (
-                    n.tag,n.text
+                    n.tag,text
                 ))
+            if self.extra is None:
+                self.extra = {}
+            self.extra[n.tag] = text
+            return
+
+        try:
+            value = converter(text)
+        except ValueError:
+            raise ReportParserError('Invalid value for %s: %s' % (n.tag,text))
+
+        if mode == FIELD_APPEND:
+            value = self.get(n.tag,()) + (value,)
+        elif mode == FIELD_SINGLE and self.has_key(n.tag):
+            raise ReportParserError('Multiple targets for %s' % n.tag)
+        setattr(self,n.tag,value)
+
+    def __getattr__(self,attr):
+        # Only called for unset slots and unknown attributes
+        try:
+            return object.__getattribute__(self,'extra')[attr]
+        except (AttributeError,TypeError,KeyError):
+            raise AttributeError('No such attribute: %s' % attr)
+
+    def __getitem__(self,item):
+        try:
+            return getattr(self,item)
+        except AttributeError:
+            raise KeyError(item)
+
+    def __setitem__(self,item,value):
+        if item in self.__fields__:
+            setattr(self,item,value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[item] = value
+
+    def __contains__(self,item):
+        return self.has_key(item)
+
+    def has_key(self,item):
+        try:
+            getattr(self,item)
+        except AttributeError:
+            return False
+        return True
+
+    def get(self,item,default=None):
+        try:
+            return getattr(self,item)
+        except AttributeError:
+            return default
+
+    def keys(self):
+        keys = [k for k in self.__fields__ if k != 'name' and self.has_key(k)]
+        if self.extra is not None:
+            keys.extend(self.extra.keys())
+        return keys
+
+    def items(self):
+        return [(k,self[k]) for k in self.keys()]
+
+class NessusPluginDetails(NessusRecord):
+    """
+    Plugin metadata shared by all results with same pluginID
+    """
+    __slots__ = REPORT_PLUGIN_FIELDS
+    __fields__ = REPORT_PLUGIN_FIELDS
+
+    def __init__(self,pluginID):
+        self.extra = None
+        self.pluginID = pluginID
+
+    def parse(self,node):
+        """
+        Parse plugin details from ReportItem node. Unknown fields are parsed
+        by NessusTargetResultItem for each result.
+        """
+        for k,v in node.items():
+            if k in REPORT_PLUGIN_FIELDS and k != 'pluginID':
+                self.__parse_attribute__(k,v)
+        for n in node.getchildren():
+            if n.tag in REPORT_FIELD_CONVERTERS and n.tag not in REPORT_INSTANCE_VALUES:
+                self.__parse_child__(n)
 
         if self.has_key('xref'):
             xref_urls = []
-            for value in self['xref']:
+            for value in self.xref:
                 try:
                     (target,id) = value.split(':',1)
                 except ValueError:
@@ -238,80 +693,387 @@ class NessusTargetResultItem(dict):
                     raise ReportParserError('Error parsing xref URL: %s' % e)
                 except KeyError,e:
                     pass
-            self['xref_urls'] = xref_urls
+            self.xref_urls = tuple(xref_urls)
+
+    def update(self,plugin):
+        """
+        Replace details with values from another record for same plugin
+        """
+        for k in REPORT_PLUGIN_FIELDS:
+            if plugin.has_key(k):
+                setattr(self,k,getattr(plugin,k))
+            elif self.has_key(k):
+                delattr(self,k)
+        self.extra = plugin.extra
+
+    def __str__(self):
+        return '%s %s' % (self.pluginID,self.get('pluginName'))
+
+class NessusPluginDetailsTable(dict):
+    """
+    Table of NessusPluginDetails records by plugin ID
+    """
+    def merge(self,plugin):
+        """
+        Merge a plugin details record to the table, returning the record to
+        be used for the plugin ID. If the plugin details already exist, the
+        newer record by plugin_modification_date is kept in existing record.
+        """
+        try:
+            existing = self[plugin.pluginID]
+        except KeyError:
+            self[plugin.pluginID] = plugin
+            return plugin
+        if existing is not plugin and \
+           plugin.get('plugin_modification_date',()) > existing.get('plugin_modification_date',()):
+            existing.update(plugin)
+        return existing
+
+class NessusTargetResultItem(NessusRecord):
+    """
+    Result for a plugin on a host. Only per-instance values are stored in the
+    result, plugin metadata is looked up from the shared NessusPluginDetails
+    record in self.plugin. With strict set to False, unknown fields are
+    stored to extra of the result instead of raising error.
+    """
+    __slots__ = REPORT_INSTANCE_FIELDS + ('host','plugin')
+    __fields__ = REPORT_INSTANCE_FIELDS
+
+    def __init__(self,host,node,plugins=None,strict=True):
+        self.host = host
+        self.extra = None
+        self.name = node.get('name')
+
+        for k,v in node.items():
+            if k in REPORT_INSTANCE_FIELDS:
+                self.__parse_attribute__(k,v)
+            elif k not in REPORT_PLUGIN_FIELDS:
+                self.extra = self.extra or {}
+                self.extra[k] = v
+        if not self.has_key('pluginID'):
+            raise ReportParserError('ReportItem without pluginID')
+
+        if plugins is not None and plugins.has_key(self.pluginID):
+            self.plugin = plugins[self.pluginID]
+        else:
+            self.plugin = NessusPluginDetails(self.pluginID)
+            self.plugin.parse(node)
+            if plugins is not None:
+                plugins[self.pluginID] = self.plugin
+
+        for n in node.getchildren():
+            if n.tag in REPORT_INSTANCE_VALUES or n.tag not in REPORT_FIELD_CONVERTERS:
+                self.__parse_child__(n,strict)
 
         if not self.has_key('address'):
-            self['address'] = self.host.address
+            self.address = self.host.address
 
     def __getattr__(self,attr):
+        # Only called for unset slots and unknown attributes
         try:
-            return self[attr]
-        except KeyError:
+            return object.__getattribute__(self,'extra')[attr]
+        except (AttributeError,TypeError,KeyError):
+            pass
+        try:
+            plugin = object.__getattribute__(self,'plugin')
+        except AttributeError:
             raise AttributeError('No such attribute: %s' % attr)
+        return getattr(plugin,attr)
+
+    def keys(self):
+        return NessusRecord.keys(self) + [
+            k for k in self.plugin.keys() if k != 'pluginID'
+        ]
 
     def __str__(self):
         return '%s: port %s severity %s' % (
             self.name,self.port,self.severity
         )
 
-class NessusReportPreferences(object):
-    def __init__(self,node):
-        self.node = node
+class NessusReportPreferences(dict):
+    """
+    Server preferences by name. Plugin preferences are stored to dictionary
+    plugin_preferences by full preference name.
+    """
+    def __init__(self,items=[]):
+        self.plugin_preferences = {}
+        for item in items:
+            if item['tag'] == 'preference':
+                self[item.get('name')] = item.get('value')
+            else:
+                self.plugin_preferences[item.get('fullName')] = item.get('selectedValue')
 
-class NessusTargetFamilies(object):
-    def __init__(self,node):
-        self.node = node
+    def __str__(self):
+        return '%d server %d plugin preferences' % (
+            len(self),len(self.plugin_preferences)
+        )
 
-class NessusPluginList(object):
-    def __init__(self,node):
-        self.node = node
+class NessusTargetFamilies(dict):
+    """
+    Plugin family selection status by family name
+    """
+    def __init__(self,items=[]):
+        for item in items:
+            self[item.get('FamilyName')] = item.get('Status')
+
+class NessusPluginList(dict):
+    """
+    Individual plugin selection status by plugin ID
+    """
+    def __init__(self,items=[]):
+        for item in items:
+            try:
+                self[int(item.get('PluginId'))] = item.get('Status')
+            except (TypeError,ValueError):
+                raise ReportParserError('Invalid PluginId: %s' % item.get('PluginId'))
+
+def parse_port_ranges(value):
+    """
+    Parse port list like 80,443,8000-8100 to list of (first,last) tuples
+    """
+    ranges = []
+    for port in value.split(','):
+        try:
+            if port.count('-') == 1:
+                (first,last) = [int(p) for p in port.split('-')]
+            else:
+                first = last = int(port)
+        except ValueError:
+            raise ReportParserError('Invalid port range: %s' % port)
+        if first > last:
+            raise ReportParserError('Invalid port range: %s' % port)
+        ranges.append((first,last))
+    return ranges
+
+class NessusResultQuery(list):
+    """
+    Compound predicate for nessus results, evaluated as a function against
+    a result. The query matches when all given criteria match:
+
+    severity            minimum severity
+    plugin_ids          collection of matching plugin IDs
+    ports               port ranges as (first,last) tuples
+    exploit_available   value for exploit_available, missing is False
+    cvss_base_score     minimum CVSS base score
+    networks            AddressFilter or list of addresses and networks
+    """
+    def __init__(self,severity=None,plugin_ids=None,ports=None,
+                 exploit_available=None,cvss_base_score=None,networks=None):
+        self.criteria = []
+        if severity is not None:
+            self.criteria.append('severity>=%s' % severity)
+            self.append(lambda r: r.severity >= severity)
+        if plugin_ids is not None:
+            plugin_ids = frozenset(plugin_ids)
+            self.criteria.append('%d plugin IDs' % len(plugin_ids))
+            self.append(lambda r: r.pluginID in plugin_ids)
+        if ports is not None:
+            self.criteria.append('ports %s' % ','.join(
+                '%d-%d' % (first,last) for (first,last) in ports
+            ))
+            self.append(lambda r: 
+                any(first <= r.port <= last for (first,last) in ports)
+            )
+        if exploit_available is not None:
+            self.criteria.append('exploit_available=%s' % exploit_available)
+            self.append(lambda r:
+                r.get('exploit_available',False) == exploit_available
+            )
+        if cvss_base_score is not None:
+            cvss_base_score = decimal.Decimal(str(cvss_base_score))
+            self.criteria.append('cvss_base_score>=%s' % cvss_base_score)
+            self.append(lambda r: 
+                r.get('cvss_base_score') is not None and \
+                r.cvss_base_score >= cvss_base_score
+            )
+        if networks is not None:
+            if not isinstance(networks,AddressFilter):
+                networks = AddressFilter(networks)
+            self.criteria.append(str(networks))
+            self.append(lambda r: r.address in networks)
+
+    def __call__(self,result):
+        for predicate in self:
+            if not predicate(result):
+                return False
+        return True
+
+    def __str__(self):
+        return ', '.join(self.criteria)
+
+class ReversedKey(object):
+    """
+    Sort key wrapper reversing comparison order of any comparable value
+    """
+    __slots__ = ('value',)
+    def __init__(self,value):
+        self.value = value
+
+    def __eq__(self,other):
+        return self.value == other.value
+
+    def __lt__(self,other):
+        return other.value < self.value
+
+    def __cmp__(self,other):
+        return cmp(other.value,self.value)
+
+def result_sort_key(*fields):
+    """
+    Return key function for sorting results by given fields. Fields
+    prefixed with - are sorted in descending order. Addresses are sorted
+    by IP version and integer value.
+    """
+    addresses = {}
+    def address_key(address):
+        key = address_string(address)
+        try:
+            return addresses[key]
+        except KeyError:
+            addresses[key] = address_value(key)
+            return addresses[key]
+
+    getters = []
+    for field in fields:
+        descending = field.startswith('-')
+        if descending:
+            field = field[1:]
+        if field == 'address':
+            if descending:
+                getters.append(lambda r: tuple(-v for v in address_key(r.address)))
+            else:
+                getters.append(lambda r: address_key(r.address))
+        elif descending:
+            getters.append(lambda r,field=field: ReversedKey(r.get(field)))
+        else:
+            getters.append(lambda r,field=field: r.get(field))
+    return lambda r: tuple(getter(r) for getter in getters)
 
 class NessusResultSet(list):
-    def __init__(self):
+    """
+    Set of nessus results merged from reports. Results are indexed by the
+    fields in NESSUS_RESULT_INDEXES while loading, and pluginid_hostmap
+    maps each plugin ID to set of address:port strings for the plugin.
+    CVE, CPE and xref identifiers are indexed to references.
+
+    With columnar set, counters, sorting and grouping by non-indexed fields
+    use a NessusFindingTable built from the results on demand. With
+    text_search set, text fields are indexed for search() to
+    text_index. Sets returned by subset() search with a subset of the
+    text index of this set instead of building a new index.
+    """
+    def __init__(self,columnar=False,text_search=False):
         self.log = logging.getLogger('modules')
+        self.plugin_details = NessusPluginDetailsTable()
+        self.columnar = columnar
+        self.text_search = text_search
+        self.reindex()
+
+    def __index_result__(self,r):
+        """
+        Add a result to the indexes
+        """
+        for field,index in self.indexes.items():
+            value = r[field]
+            if field == 'address':
+                value = address_string(value)
+            try:
+                index[value].append(r)
+            except KeyError:
+                index[value] = [r]
+
+        if r.port != 0:
+            r_key = '%s:%s' % (address_string(r.address),r.port)
+        else:
+            r_key = '%s' % address_string(r.address)
+        try:
+            self.pluginid_hostmap[r.pluginID].add(r_key)
+        except KeyError:
+            self.pluginid_hostmap[r.pluginID] = set([r_key])
+        self.references.add(r,r_key)
+        if self.text_index is not None:
+            self.text_index.add(r)
+
+    def reindex(self):
+        """
+        Rebuild result indexes
+        """
         self.pluginid_hostmap = {}
+        self.indexes = dict((field,{}) for field in NESSUS_RESULT_INDEXES)
+        self.references = NessusReferenceIndex()
+        if self.text_search:
+            self.text_index = NessusTextIndex()
+        else:
+            self.text_index = None
+        self.table = None
+        for r in self:
+            self.__index_result__(r)
 
-    def __sortkeys__(self,*argv):
-        return lambda mapping: tuple(-mapping[name[1:]] if name.startswith('-') else mapping[name] for name in argv)
+    def columns(self):
+        """
+        Return NessusFindingTable for current results, built when results
+        have changed since last call
+        """
+        if self.table is None or len(self.table) != len(self):
+            self.log.debug('Building result table for %d results' % len(self))
+            self.table = NessusFindingTable(self)
+        return self.table
 
-    def load(self,reports,filtered,addresses=[]):
-        networks = filter(lambda address: 
-            (type(address)==IPv4Address and address.bitmask!=32) or\
-            (type(address)==IPv6Address and address.bitmask!=128),
-            addresses
-        )
-        def match_address(address,addresses,networks):
-            if address in addresses:
-                return True
-            networks = filter(lambda n: type(n)==type(address), networks)
-            for n in networks:
-                if n.addressInNetwork(address):
-                    return True
-            return False
+    def __results__(self,source):
+        """
+        Return iterator for results in a NessusXMLReport, NessusXMLStream
+        or any iterable or generator yielding NessusTargetResultItem objects
+        """
+        if hasattr(source,'results'):
+            return source.results()
+        return iter(source)
+
+    def load(self,reports,filtered,addresses=[],store=None):
+        """
+        Load results from reports, skipping plugin IDs in filtered, which
+        may be a set of plugin IDs or a NessusPluginFilter. If
+        addresses is given as AddressFilter or list of addresses and networks,
+        only results for matching addresses are loaded.
+
+        If a NessusResultStore is given as store, results from reports are
+        added to the store first, and all results in the store are loaded.
+        Reports for the store should be parsed without plugin_filter, so
+        that results filtered now are available with other filters later.
+        """
+        if not isinstance(addresses,AddressFilter):
+            addresses = AddressFilter(addresses)
+        if store is not None:
+            store.add_reports(reports)
+            reports = [store]
+        if self.text_index is not None and self.text_index.members is not None:
+            # Build own text index instead of the shared index subset
+            self.text_index = NessusTextIndex()
+            for r in self:
+                self.text_index.add(r)
+
+        if isinstance(filtered,NessusPluginFilter):
+            is_filtered = filtered.match
+        else:
+            is_filtered = lambda r: r.pluginID in filtered
 
         for source in reports:
-            self.log.debug('Merging report with %d plugin IDs filtered: %s' % (
+            self.log.debug('Merging report with %d plugin filters: %s' % (
                 len(filtered),source
             ))
             filtered_count = 0
             filter_address_count = 0
-            for r in [result for report in source for host in report for result in host]:
-                if r.pluginID in filtered:
+            for r in self.__results__(source):
+                if is_filtered(r):
                     filtered_count += 1
                     continue
-                if addresses!=[] and not match_address(r.address,addresses,networks):
+                if len(addresses) and r.address not in addresses:
                     filter_address_count += 1
                     continue 
-                if not self.pluginid_hostmap.has_key(r.pluginID):
-                    self.pluginid_hostmap[r.pluginID] = []
-                if r.port != 0:
-                    r_key = '%s:%s' % (r.address.ipaddress,r.port)
-                else:
-                    r_key = '%s' % r.address.ipaddress
-                if r_key not in self.pluginid_hostmap[r.pluginID]:
-                    self.pluginid_hostmap[r.pluginID].append(r_key)
+                r.plugin = self.plugin_details.merge(r.plugin)
+                self.__index_result__(r)
                 self.append(r)
-            if addresses!=[]:
+            self.table = None
+            if len(addresses):
                 self.log.debug('Filtered out %d plugins %d addresses' % (
                     filtered_count,filter_address_count
                 ))
@@ -319,74 +1081,172 @@ class NessusResultSet(list):
                 self.log.debug('Filtered out %d plugins' % filtered_count)
 
     def order_by(self,*argv):
+        """
+        Sort results in place by given fields, with - prefix for descending
+        order. The sort is stable.
+        """
         self.log.debug('Ordering results')
-        decorated = [(
-            [-result[k[1:]] if k.startswith('-') else result[k] for k in argv],
-            index,
-            result
-        ) for index,result in enumerate(self)]
-        decorated.sort()
-        self.__delslice__(0,len(self))
-        self.extend([d[-1] for d in decorated])
+        if self.columnar:
+            self[:] = self.columns().order_by(*argv)
+            self.table = None
+            return
+        self.sort(key=result_sort_key(*argv))
+
+    def top(self,limit,*argv):
+        """
+        Return list of first limit results ordered by given fields, without
+        sorting all results
+        """
+        if self.columnar:
+            return self.columns().top(limit,*argv)
+        return heapq.nsmallest(limit,self,key=result_sort_key(*argv))
 
     def pluginid_hosts(self,result):
         self.log.debug('Grouping hosts for plugin: %s %s' % (
             SEVERITY_NAMES[result.severity],result.pluginName
         ))
-        return [h.ipaddress for h in sorted(
-            set(r.address for r in self if r.pluginID == result.pluginID) 
-        )]
+        return sorted(
+            set(address_string(r.address) for r in self.lookup('pluginID',result.pluginID)),
+            key=address_value
+        )
+
+    def lookup(self,field,value):
+        """
+        Return list of results with given value for an indexed field
+        """
+        if field not in self.indexes:
+            raise ReportParserError('Field is not indexed: %s' % field)
+        if field == 'address':
+            value = address_string(value)
+        return self.indexes[field].get(value,[])
+
+    def lookup_references(self,identifiers):
+        """
+        Return list of results matching any of given CVE, CPE or xref
+        identifiers
+        """
+        results = []
+        for plugin_id in sorted(self.references.plugin_ids(identifiers)):
+            results.extend(self.lookup('pluginID',plugin_id))
+        return results
+
+    def group_by(self,field):
+        """
+        Return results grouped to a dictionary by field value. Indexed fields
+        are returned from the index, others are grouped in one pass.
+        Addresses are grouped by address string, because IPv6Address objects
+        are not hashable.
+        """
+        if field in self.indexes:
+            return self.indexes[field]
+        if self.columnar and field in GROUPED_COLUMNS:
+            return self.columns().group_by(field)
+        groups = {}
+        for r in self:
+            try:
+                groups[r.get(field)].append(r)
+            except KeyError:
+                groups[r.get(field)] = [r]
+        return groups
 
     def filter(self,fn):
+        """
+        Remove results not matching fn from the result set in one pass
+        """
         self.log.debug('Filtering %d results' % len(self))
-        total=len(self)
-        processed=0
-        for r in self:
-            processed+=1
-            if not fn(r): 
-                self.remove(r)
-            if processed%1000==0:
-                self.log.debug('Processed: %d/%d results' % (processed,total))
+        self[:] = [r for r in self if fn(r)]
+        self.log.debug('Filtered to %d results' % len(self))
+        self.reindex()
+
+    def subset(self,results):
+        """
+        Return a new result set with given results from this set, sharing
+        the plugin details table
+        """
+        subset = NessusResultSet(columnar=self.columnar)
+        subset.plugin_details = self.plugin_details
+        subset.extend(results)
+        subset.reindex()
+        if self.text_index is not None:
+            subset.text_search = True
+            subset.text_index = self.text_index.subset(subset)
+        return subset
+
+    def select(self,fn):
+        """
+        Return new result set with results matching fn, without modifying
+        this result set
+        """
+        return self.subset(r for r in self if fn(r))
+
+    def search(self,pattern,fields=TEXT_INDEX_FIELDS,flags=0):
+        """
+        Return new result set with results where regular expression pattern
+        matches any of given text fields. The text index is used if enabled.
+        """
+        self.log.debug('Searching %d results: %s' % (len(self),pattern))
+        if self.text_index is not None:
+            return self.subset(self.text_index.search(pattern,fields,flags))
+        pattern = text_pattern(pattern)
+        try:
+            expression = re.compile(pattern,flags|re.UNICODE)
+        except re.error,e:
+            raise ReportParserError('Invalid search pattern %s: %s' % (pattern,e))
+        return self.select(lambda r: [field for field in fields
+            if text_value(r.get(field)) and expression.search(text_value(r[field]))
+        ])
+
+    def query(self,**criteria):
+        """
+        Return new result set with results matching all given criteria. See
+        NessusResultQuery for supported criteria.
+        """
+        query = NessusResultQuery(**criteria)
+        self.log.debug('Querying %d results: %s' % (len(self),query))
+        return self.select(query)
 
     def counters(self):
+        if self.columnar:
+            return self.columns().counters()
         values = dict([(r,0) for r in range(0,4)]) 
         for r in self:
             values[r.severity] += 1
         return values
 
     def merge_pluginlist_file(self,path,filtered_ids):
+        """
+        Merge filtered plugins from a file to filtered_ids. If filtered_ids
+        is a NessusPluginFilter, all filter rules are supported, otherwise
+        the file must list plugin IDs.
+        """
+        if isinstance(filtered_ids,NessusPluginFilter):
+            filtered_ids.add_file(path)
+            return filtered_ids
         try:
             for l in open(path,'r').readlines():
-                if l.startswith('#'): continue
-                (pid,description) = l.strip().split(None,1)
+                if l.startswith('#') or l.strip() == '': continue
+                pid = l.split()[0]
                 try:
                     filtered_ids.add(int(pid)) 
                 except ValueError:
-                    sys.exit(error('Invalid Plugin ID: %s' % pid))
-        except IOError,(ecode,emsg):
+                    raise ReportParserError('Invalid Plugin ID: %s' % pid)
+        except (IOError,OSError),(ecode,emsg):
             raise ReportParserError(
-                'Error reading filtered plugin list file %s %s' % (
-                opts.filter_plugins,emsg
-            ))
-        except OSError,(ecode,emsg):
-            raise ReportParserError(
-                'Error reading filtered plugin list file %s %s' % (
-                opts.filter_plugins,emsg
-            ))
+                'Error reading filtered plugin list file %s %s' % (path,emsg)
+            )
         return filtered_ids
 
-    def load_addresslist(self,values):
+    def load_addresslist(self,values,exclude=[],paths=[],exclude_paths=[]):
+        """
+        Return AddressFilter for given included and excluded addresses and
+        networks, and address list files
+        """
         self.log.debug('Loading address list %s' % values)
-        addresses = []
-        for address in values:
-            try:
-                address = IPv4Address(address)  
-            except ValueError:
-                try:
-                    address = IPv6Address(address)
-                except ValueError:
-                    raise ReportParserError('Invalid address: %s' % address)
-            addresses.append(address)
+        addresses = AddressFilter(values,exclude)
+        for path in paths:
+            addresses.add_file(path)
+        for path in exclude_paths:
+            addresses.add_file(path,exclude=True)
         return addresses
 
 if __name__ == '__main__':
@@ -1,16 +1,25 @@
 
+import os,time,logging
 from lxml import etree
 
 from scanreports import ReportParserError
-from seine.address import IPv4Address,IPv6Address
+from scanreports.addresslist import parse_address
 
 class NMAPXMLOutputFile(object):
-    def __init__(self,path):
+    """
+    Parsed nmap XML output file. With recover set, files of running or
+    interrupted scans are read with NMAPXMLStream, keeping complete hosts.
+    """
+    def __init__(self,path,recover=False):
         self.path = path
+        self.complete = True
         try:
             self.tree = etree.parse(self.path)
         except etree.XMLSyntaxError,e:
-            raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+            if not recover:
+                raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+            self.__recover__()
+            return
 
         root = self.tree.getroot()
         if root.tag != 'nmaprun':
@@ -19,8 +28,16 @@ class NMAPXMLOutputFile(object):
         self.version = root.get('version') 
         self.args = root.get('args') 
         self.start_ts = int(root.get('start'))
-        self.scaninfo = NMAPScanInfo(self.tree.find('scaninfo'))
-        self.runstats = NMAPRunStats(self.tree.find('runstats'))
+        self.scaninfo = None
+        self.runstats = None
+        node = self.tree.find('scaninfo')
+        if node is not None:
+            self.scaninfo = NMAPScanInfo(node)
+        node = self.tree.find('runstats')
+        if node is not None:
+            self.runstats = NMAPRunStats(node)
+        else:
+            self.complete = False
 
         try:
             self.hosts = map(lambda h:
@@ -30,21 +47,213 @@ class NMAPXMLOutputFile(object):
         except ReportParserError,e:
             raise ReportParserError('Error parsing %s: %s' % (self.path,e))
 
+    def __recover__(self):
+        stream = NMAPXMLStream(self.path,recover=True)
+        self.tree = None
+        self.hosts = list(stream)
+        self.scanner = stream.scanner
+        self.version = stream.version
+        self.args = stream.args
+        self.start_ts = stream.start_ts
+        self.scaninfo = stream.scaninfo
+        self.runstats = stream.runstats
+        self.complete = stream.complete
+
+    def __str__(self):
+        return '%s (%s at %s)' % (
+            self.path,
+            self.args,
+            time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(self.start_ts)),
+        )
+
+# Elements processed by NMAPXMLStream
+NMAP_STREAM_ELEMENTS = ('nmaprun','host','scaninfo','runstats')
+
+class NMAPXMLStream(object):
+    """
+    Streaming reader for nmap XML output files. Iterating the stream yields
+    NMAPTargetHostEntry objects for host elements, which are cleared from
+    the tree after conversion. Run details are set while iterating: runstats
+    is available after all hosts have been read.
+
+    With recover set, a file ending before </nmaprun>, as written by a
+    running or killed scan, yields all complete hosts without error and
+    leaves complete False.
+    """
+    def __init__(self,path,recover=False):
+        self.log = logging.getLogger('modules')
+        self.path = path
+        self.recover = recover
+        self.root = None
+        self.complete = False
+        self.scanner = None
+        self.version = None
+        self.args = None
+        self.start_ts = None
+        self.scaninfo = None
+        self.runstats = None
+
     def __str__(self):
+        if self.start_ts is None:
+            return self.path
         return '%s (%s at %s)' % (
             self.path,
             self.args,
             time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(self.start_ts)),
         )
 
+    def __parse_root__(self,root):
+        if root.tag != 'nmaprun':
+            raise ReportParserError('Input is not supported NMAP XML output file')
+        self.scanner = root.get('scanner')
+        self.version = root.get('version')
+        self.args = root.get('args')
+        try:
+            self.start_ts = int(root.get('start'))
+        except (TypeError,ValueError):
+            raise ReportParserError('Invalid start time: %s' % root.get('start'))
+
+    def __process_events__(self,events):
+        """
+        Process (event,node) tuples from parser, yielding hosts
+        """
+        for (event,node) in events:
+            if self.root is None:
+                self.root = node.getroottree().getroot()
+                self.__parse_root__(self.root)
+            if event == 'start':
+                continue
+            if node is self.root:
+                self.complete = True
+                continue
+            if node.getparent() is not self.root:
+                continue
+            if node.tag == 'host':
+                yield NMAPTargetHostEntry(node)
+            elif node.tag == 'scaninfo':
+                self.scaninfo = NMAPScanInfo(node)
+            elif node.tag == 'runstats':
+                self.runstats = NMAPRunStats(node)
+
+            # Drop processed element and previous siblings
+            node.clear()
+            while node.getprevious() is not None:
+                del self.root[0]
+
+    def __iter__(self):
+        self.root = None
+        self.complete = False
+        try:
+            context = etree.iterparse(self.path,
+                events=('start','end'),tag=NMAP_STREAM_ELEMENTS
+            )
+            for host in self.__process_events__(context):
+                yield host
+        except etree.XMLSyntaxError,e:
+            if not self.recover or self.root is None:
+                raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+            self.log.debug('Incomplete file %s: %s' % (self.path,e))
+        except ReportParserError,e:
+            raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+        if self.root is None:
+            raise ReportParserError('Error parsing %s: %s' % (
+                self.path,'Input is not supported NMAP XML output file'
+            ))
+
+class NMAPXMLFollower(NMAPXMLStream):
+    """
+    Follows a nmap XML output file written by a running scan. Data appended
+    to the file after previous poll() is fed to an incremental parser, so
+    the file is not parsed again from the start. If the file is truncated,
+    or replaced by another file (different device or inode), it is read
+    again from the start.
+    """
+    def __init__(self,path,blocksize=65536):
+        NMAPXMLStream.__init__(self,path,recover=True)
+        self.blocksize = blocksize
+        self.reset()
+
+    def reset(self):
+        self.inode = None
+        self.offset = 0
+        self.root = None
+        self.complete = False
+        self.scanner = None
+        self.version = None
+        self.args = None
+        self.start_ts = None
+        self.scaninfo = None
+        self.runstats = None
+        self.parser = etree.XMLPullParser(
+            events=('start','end'),tag=NMAP_STREAM_ELEMENTS
+        )
+
+    def poll(self):
+        """
+        Return list of hosts completed in the file since previous poll
+        """
+        hosts = []
+        try:
+            fd = open(self.path,'rb')
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error reading %s: %s' % (self.path,emsg))
+        try:
+            try:
+                stat = os.fstat(fd.fileno())
+                inode = (stat.st_dev,stat.st_ino)
+                if self.inode is not None and inode != self.inode:
+                    self.log.debug('File %s replaced, reading from start' % self.path)
+                    self.reset()
+                elif stat.st_size < self.offset:
+                    self.log.debug('File %s truncated, reading from start' % self.path)
+                    self.reset()
+                self.inode = inode
+                fd.seek(self.offset)
+                while True:
+                    data = fd.read(self.blocksize)
+                    if not data:
+                        break
+                    self.offset += len(data)
+                    self.parser.feed(data)
+                    hosts.extend(self.__process_events__(self.parser.read_events()))
+            except (IOError,OSError),(ecode,emsg):
+                raise ReportParserError('Error reading %s: %s' % (self.path,emsg))
+            except etree.XMLSyntaxError,e:
+                raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+            except ReportParserError,e:
+                raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+        finally:
+            fd.close()
+        return hosts
+
+# Cached host attributes: filtered lists of addresses or ports
+HOST_ADDRESS_LISTS = {
+    'ipv4_addresses':   'ipv4',
+    'ipv6_addresses':   'ipv6',
+    'mac_addresses':    'mac',
+}
+HOST_PORT_LISTS = {
+    'tcp_ports':    'tcp',
+    'udp_ports':    'udp',
+}
+
 class NMAPTargetHostEntry(object):
+    """
+    Host from nmap scans. Ports are kept in file order in ports, with the
+    entry from the latest scan of each port. port_index maps (protocol,portid)
+    to [position in ports,latest scan start time], and port_history lists
+    (scan start time,port entry) tuples for all scans.
+    Address and port lists by type are cached until the host is merged.
+    """
     def __init__(self,node):
         self.nmapscans = [ NMAPHostScan(node) ]
+        self.ports = []
+        self.port_index = {}
+        self.port_history = {}
+        self.cache = {}
         try:
-            self.ports = map(lambda p: 
-                NMAPTargetPortEntry(p),
-                node.find('ports').findall('port'),
-            )
+            for p in node.find('ports').findall('port'):
+                self.__add_port__(NMAPTargetPortEntry(p),self.nmapscans[0].start_ts)
             self.addresses = map(lambda a:
                 NMAPHostAddressEntry(a),
                 node.findall('address'),
@@ -56,14 +265,17 @@ class NMAPTargetHostEntry(object):
             )
 
     def __getattr__(self,attr):
-        if attr == 'ipv4_addresses':
-            return filter(lambda a: a['addrtype'] == 'ipv4', self.addresses)
-        if attr == 'mac_addresses':
-            return filter(lambda a: a['addrtype'] == 'mac', self.addresses)
-        if attr == 'udp_ports':
-            return filter(lambda p: p['protocol'] == 'udp', self.ports)
-        if attr == 'tcp_ports':
-            return filter(lambda p: p['protocol'] == 'tcp', self.ports)
+        cache = self.__dict__.get('cache')
+        if cache is not None and attr in cache:
+            return cache[attr]
+        if attr in HOST_ADDRESS_LISTS:
+            addrtype = HOST_ADDRESS_LISTS[attr]
+            cache[attr] = filter(lambda a: a['addrtype'] == addrtype, self.addresses)
+            return cache[attr]
+        if attr in HOST_PORT_LISTS:
+            protocol = HOST_PORT_LISTS[attr]
+            cache[attr] = filter(lambda p: p['protocol'] == protocol, self.ports)
+            return cache[attr]
         if attr == 'os':
             if len(self.osinfo) == 1:
                 osc = self.osinfo[0]
@@ -78,13 +290,41 @@ class NMAPTargetHostEntry(object):
             self.ipv4_addresses[0], len(self.ports), self.os,
         )
 
+    def __add_port__(self,port,start_ts):
+        """
+        Add port entry from scan started at start_ts. The entry replaces
+        existing entry for the port unless it is from a later scan.
+        """
+        key = (port['protocol'],port['portid'])
+        self.port_history.setdefault(key,[]).append((start_ts,port))
+        try:
+            entry = self.port_index[key]
+        except KeyError:
+            self.port_index[key] = [len(self.ports),start_ts]
+            self.ports.append(port)
+            return
+        if start_ts >= entry[1]:
+            self.ports[entry[0]] = port
+            entry[1] = start_ts
+
+    def port(self,protocol,portid):
+        """
+        Return latest port entry for protocol and port number, or None
+        """
+        try:
+            return self.ports[self.port_index[(protocol,portid)][0]]
+        except KeyError:
+            return None
+
     def merge(self,host):
         for run in self.nmapscans:
             for newrun in host.nmapscans:
                 if newrun.start_ts == run.start_ts and newrun.end_ts == run.end_ts:
                     return
         self.nmapscans += host.nmapscans
-        self.ports += host.ports
+        for p in host.ports:
+            for (start_ts,port) in host.port_history[(p['protocol'],p['portid'])]:
+                self.__add_port__(port,start_ts)
         for k in ['ipv4','ipv6','mac']:
             my_values = filter(lambda a: a['addrtype']==k, self.addresses)
             host_values = filter(lambda a: a['addrtype']==k, host.addresses)
@@ -93,6 +333,7 @@ class NMAPTargetHostEntry(object):
                 if len(matches) == 0:
                     self.addresses.append(a)
                     break
+        self.cache.clear()
 
 class NMAPHostScan(object):
     def __init__(self,node):
@@ -236,51 +477,173 @@ class NMAPScanInfo(dict):
             self['type'],self['protocol'],self['numservices']
         )
 
-def same_target(a,b):
-    for k in ['ipv4','ipv6','mac']:
-        a_values = filter(lambda a: a['addrtype']==k, a.addresses)
-        b_values = filter(lambda a: a['addrtype']==k, b.addresses)
-        for a_addr in a_values:
-            for b_addr in b_values:
-                if a_addr['addr'] == b_addr['addr']:
-                    return True
-    return False
+# Address types used to identify same target in different scans
+TARGET_ADDRESS_TYPES = ['ipv4','ipv6','mac']
+
+def host_sort_key(host):
+    """
+    Return sort key for NMAPTargetHostEntry: hosts are ordered by first
+    address if it is IPv4 or IPv6, otherwise by first IPv4, IPv6 or MAC
+    address in that order, and hosts without addresses last.
+    """
+    addresses = [a for a in host.addresses if a['addrtype'] in TARGET_ADDRESS_TYPES]
+    if addresses and addresses[0]['addrtype'] != 'mac':
+        first = addresses[0]
+    else:
+        first = None
+        for addrtype in TARGET_ADDRESS_TYPES:
+            for a in addresses:
+                if a['addrtype'] == addrtype:
+                    first = a
+                    break
+            if first is not None:
+                break
+    if first is None:
+        return (len(TARGET_ADDRESS_TYPES),0)
+    try:
+        if first['addrtype'] == 'mac':
+            value = int(first['addr'].replace(':','').replace('-',''),16)
+        else:
+            value = parse_address(first['addr'])[1]
+    except (ValueError,ReportParserError):
+        raise ReportParserError('Invalid %s address: %s' % (
+            first['addrtype'],first['addr']
+        ))
+    return (TARGET_ADDRESS_TYPES.index(first['addrtype']),value)
 
 class NMAPSummary(object):
-    def __init__(self):
+    """
+    Hosts merged from nmap XML output files. Hosts are identified by any
+    IPv4, IPv6 or MAC address, looked up from index mapping (addrtype,addr)
+    tuples to lists of hosts with the address.
+
+    Hosts are kept in read order in unsorted_hosts, and sorted by address
+    when hosts is accessed. The sorted list is cached until hosts change.
+
+    With streaming set, files not loaded from cache are read with
+    NMAPXMLStream without keeping the XML tree in memory. With recover set,
+    complete hosts are read from files of running or interrupted scans.
+    Files of running scans can be followed, merging new hosts with update().
+    """
+    def __init__(self,cache=None,streaming=False,recover=False):
         self.files = []
-        self.hosts = [] 
+        self.unsorted_hosts = []
+        self.sorted_hosts = None
+        self.index = {}
+        self.cache = cache
+        self.streaming = streaming
+        self.recover = recover
 
     def __str__(self):
         return '%d unique hosts from %d files' % (
-            len(self.hosts), len(self.files)
+            len(self.unsorted_hosts), len(self.files)
         )
 
+    @property
+    def hosts(self):
+        if self.sorted_hosts is None:
+            self.sorted_hosts = sorted(self.unsorted_hosts,key=host_sort_key)
+        return self.sorted_hosts
+
+    def __index_host__(self,host):
+        for a in host.addresses:
+            if a['addrtype'] not in TARGET_ADDRESS_TYPES:
+                continue
+            hosts = self.index.setdefault((a['addrtype'],a['addr']),[])
+            if host not in hosts:
+                hosts.append(host)
+
     def find_host(self,host):
-        for h in self.hosts:
-            if same_target(host,h):
-                return h 
-        return None 
+        """
+        Return known host with any same address as host from the address
+        index, or None if host is not known. If addresses match several
+        hosts, the one read first (earliest in unsorted_hosts) is returned
+        """
+        matches = []
+        for a in host.addresses:
+            if a['addrtype'] not in TARGET_ADDRESS_TYPES:
+                continue
+            for h in self.index.get((a['addrtype'],a['addr']),[]):
+                if h not in matches:
+                    matches.append(h)
+        if not matches:
+            return None
+        if len(matches) == 1:
+            return matches[0]
+        return min(matches,key=self.unsorted_hosts.index)
 
     def read(self,path):
         try:
-            entry = NMAPXMLOutputFile(path)
+            if self.cache is not None:
+                entry = self.cache.load(path,
+                    lambda path: NMAPXMLOutputFile(path,self.recover),
+                    'NMAPXMLOutputFile recover=%s' % self.recover
+                )
+                hosts = entry.hosts
+            elif self.streaming:
+                # Hosts are merged only after the whole file is parsed
+                entry = NMAPXMLStream(path,self.recover)
+                hosts = list(entry)
+            else:
+                entry = NMAPXMLOutputFile(path,self.recover)
+                hosts = entry.hosts
         except ReportParserError,e:
             raise ReportParserError(e)
 
         self.files.append(entry)
-        for h in entry.hosts:
+        self.add_hosts(hosts)
+
+    def add_hosts(self,hosts):
+        """
+        Add or merge hosts, returning list of new and updated hosts
+        """
+        updated = []
+        seen = set()
+        for h in hosts:
+            self.sorted_hosts = None
             host = self.find_host(h)
             if not host:
-                self.hosts.append(h)
-                continue
-            # Merge details of hosts
-            host.merge(h)    
-
-        self.hosts.sort(lambda y,x: cmp(
-            IPv4Address(y.addresses[0]['addr']).address,
-            IPv4Address(x.addresses[0]['addr']).address,
-        ))
+                self.unsorted_hosts.append(h)
+                self.__index_host__(h)
+                host = h
+            else:
+                # Merge details of hosts
+                host.merge(h)
+                self.__index_host__(host)
+            if id(host) not in seen:
+                seen.add(id(host))
+                updated.append(host)
+        return updated
+
+    def follow(self,path):
+        """
+        Follow nmap XML output file of a running scan. Hosts in the file are
+        merged by update().
+        """
+        follower = NMAPXMLFollower(path)
+        self.files.append(follower)
+        return follower
+
+    def update(self):
+        """
+        Merge hosts completed in followed files since previous update,
+        returning list of new and updated hosts
+        """
+        hosts = []
+        for entry in self.files:
+            if isinstance(entry,NMAPXMLFollower):
+                hosts.extend(entry.poll())
+        return self.add_hosts(hosts)
+
+    @property
+    def complete(self):
+        """
+        True if all files have been completely written
+        """
+        for entry in self.files:
+            if not getattr(entry,'complete',True):
+                return False
+        return True
 
 if __name__ == '__main__':
     nms = NMAPSummary()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Compiled plugin filter rules for nessus results. Rule files contain one rule
+per line, empty lines and lines starting with # are ignored:
+
+12345 [description]         plugin ID
+10000-10100 [description]   range of plugin IDs
+family <family name>        plugin family
+name <regexp>               plugin name regular expression
+severity <level>            results below severity level
+except <addresses> <rule>   do not filter results matching rule for
+                            comma separated addresses and networks
+
+Plugin IDs are compiled to a bitmap and regular expressions to one pattern,
+so checking a result does not depend on the number of rules.
+"""
+
+import re,hashlib
+
+from scanreports import ReportParserError
+from scanreports.addresslist import AddressFilter
+
+# Largest plugin ID stored in the bitmap, larger IDs are checked from ranges
+BITMAP_MAX_PLUGIN_ID = 2**22
+
+def parse_plugin_id(value):
+    try:
+        value = int(value)
+    except ValueError:
+        raise ReportParserError('Invalid plugin ID: %s' % value)
+    if value < 0:
+        raise ReportParserError('Invalid plugin ID: %s' % value)
+    return value
+
+class NessusPluginFilter(object):
+    """
+    Filter rules for nessus results. A result is filtered if it matches any
+    rule, unless it matches an exception for the result address. Plugin IDs
+    can be checked with 'pluginID in filter' like with a set of IDs.
+    """
+    def __init__(self,plugin_ids=[]):
+        self.rules = []
+        self.ranges = []
+        self.families = set()
+        self.names = []
+        self.min_severity = None
+        self.exceptions = []
+        self.bitmap = None
+        self.name_pattern = None
+        for plugin_id in plugin_ids:
+            self.add(plugin_id)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __str__(self):
+        return '%d plugin filter rules' % len(self.rules)
+
+    def digest(self):
+        """
+        Return digest of the rules, for cache keys
+        """
+        return hashlib.sha1('\n'.join(self.rules)).hexdigest()
+
+    def add(self,plugin_id):
+        """
+        Add a plugin ID to filtered plugins
+        """
+        plugin_id = parse_plugin_id(plugin_id)
+        self.add_rule(str(plugin_id))
+
+    def add_rule(self,line):
+        """
+        Add a rule in rule file syntax
+        """
+        line = line.strip()
+        try:
+            (rule,value) = line.split(None,1)
+        except ValueError:
+            (rule,value) = (line,'')
+
+        if rule == 'family':
+            if not value:
+                raise ReportParserError('Missing plugin family: %s' % line)
+            self.families.add(value.strip())
+        elif rule == 'name':
+            try:
+                re.compile(value.strip())
+            except re.error,e:
+                raise ReportParserError('Invalid plugin name pattern %s: %s' % (value,e))
+            self.names.append(value.strip())
+        elif rule == 'severity':
+            try:
+                self.min_severity = max(self.min_severity,int(value))
+            except ValueError:
+                raise ReportParserError('Invalid severity: %s' % value)
+        elif rule == 'except':
+            try:
+                (addresses,value) = value.split(None,1)
+            except ValueError:
+                raise ReportParserError('Invalid exception rule: %s' % line)
+            exception = NessusPluginFilter()
+            exception.add_rule(value)
+            self.exceptions.append((AddressFilter(addresses.split(',')),exception))
+        elif '-' in rule:
+            (first,last) = [parse_plugin_id(x) for x in rule.split('-',1)]
+            if first > last:
+                raise ReportParserError('Invalid plugin ID range: %s' % rule)
+            self.ranges.append((first,last))
+        else:
+            plugin_id = parse_plugin_id(rule)
+            self.ranges.append((plugin_id,plugin_id))
+
+        self.rules.append(line)
+        self.bitmap = None
+
+    def add_file(self,path):
+        """
+        Add rules from a rule file
+        """
+        try:
+            lines = open(path,'r').readlines()
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError(
+                'Error reading filtered plugin list file %s: %s' % (path,emsg)
+            )
+        for line in lines:
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            try:
+                self.add_rule(line)
+            except ReportParserError,e:
+                raise ReportParserError('Error in %s: %s' % (path,e))
+
+    def compile(self):
+        """
+        Compile plugin ID ranges to bitmap and name patterns to one pattern
+        """
+        size = min(
+            max([last for (first,last) in self.ranges] + [0]),
+            BITMAP_MAX_PLUGIN_ID
+        )
+        self.bitmap = bytearray(size/8+1)
+        self.large_ranges = []
+        for (first,last) in self.ranges:
+            if last > BITMAP_MAX_PLUGIN_ID:
+                self.large_ranges.append((first,last))
+            for plugin_id in xrange(first,min(last,BITMAP_MAX_PLUGIN_ID)+1):
+                self.bitmap[plugin_id>>3] |= 1 << (plugin_id&7)
+        if self.names:
+            self.name_pattern = re.compile('|'.join(
+                '(?:%s)' % name for name in self.names
+            ))
+        else:
+            self.name_pattern = None
+
+    def __contains__(self,plugin_id):
+        if self.bitmap is None:
+            self.compile()
+        if plugin_id <= BITMAP_MAX_PLUGIN_ID:
+            if plugin_id >> 3 >= len(self.bitmap):
+                return False
+            return bool(self.bitmap[plugin_id>>3] & (1 << (plugin_id&7)))
+        for (first,last) in self.large_ranges:
+            if first <= plugin_id <= last:
+                return True
+        return False
+
+    def __match__(self,plugin_id,family,name,severity):
+        if plugin_id in self:
+            return True
+        if family is not None and family in self.families:
+            return True
+        if name is not None and self.name_pattern is not None and \
+           self.name_pattern.search(name):
+            return True
+        if severity is not None and self.min_severity is not None and \
+           severity < self.min_severity:
+            return True
+        return False
+
+    def match_values(self,plugin_id,family=None,name=None,severity=None,address=None):
+        """
+        Return True if result with given values is filtered
+        """
+        if not self.__match__(plugin_id,family,name,severity):
+            return False
+        if address is not None:
+            for (addresses,exception) in self.exceptions:
+                if address in addresses and \
+                   exception.__match__(plugin_id,family,name,severity):
+                    return False
+        return True
+
+    def match(self,result):
+        """
+        Return True if a NessusTargetResultItem is filtered
+        """
+        return self.match_values(
+            result.pluginID,
+            result.get('pluginFamily'),
+            result.get('pluginName'),
+            result.get('severity'),
+            result.address,
+        )
+
+    def match_node(self,node,address):
+        """
+        Return True if ReportItem node for address is filtered, so the
+        result does not need to be parsed
+        """
+        try:
+            plugin_id = int(node.get('pluginID'))
+            severity = node.get('severity')
+            if severity is not None:
+                severity = int(severity)
+        except (TypeError,ValueError):
+            # Invalid values are reported by the parser
+            return False
+        return self.match_values(plugin_id,
+            node.get('pluginFamily'),node.get('pluginName'),severity,address
+        )
+
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Inverted index of CVE, CPE and xref identifiers in nessus results
+"""
+
+import os,cPickle
+
+from scanreports import ReportParserError
+
+# Plugin fields indexed as identifiers
+REFERENCE_INDEX_FIELDS = ['cve','cpe','xref']
+
+# Increase when the saved index format changes
+REFERENCE_INDEX_VERSION = 1
+
+def normalize_identifier(value):
+    return value.strip().upper()
+
+class NessusReferenceIndex(dict):
+    """
+    Index of identifiers to sets of plugin IDs. For each indexed plugin,
+    hosts maps plugin ID to set of address:port strings and plugins to
+    (pluginName,severity) tuple, so queries can be answered from a saved
+    index without the reports.
+    """
+    def __init__(self,path=None):
+        self.path = path
+        self.hosts = {}
+        self.plugins = {}
+        if path is not None and os.path.isfile(path):
+            self.load(path)
+
+    def __str__(self):
+        return '%d identifiers for %d plugins' % (len(self),len(self.plugins))
+
+    def add(self,result,host_key):
+        """
+        Add a result with address:port host_key to the index
+        """
+        plugin_id = result.pluginID
+        if plugin_id not in self.plugins:
+            self.plugins[plugin_id] = (result.get('pluginName'),result.severity)
+            for field in REFERENCE_INDEX_FIELDS:
+                for value in result.get(field,()):
+                    self.setdefault(normalize_identifier(value),set()).add(plugin_id)
+        try:
+            self.hosts[plugin_id].add(host_key)
+        except KeyError:
+            self.hosts[plugin_id] = set([host_key])
+
+    def lookup(self,identifiers):
+        """
+        Return dictionary of matching identifiers to sets of plugin IDs
+        """
+        matches = {}
+        for identifier in identifiers:
+            identifier = normalize_identifier(identifier)
+            if identifier in self:
+                matches[identifier] = self[identifier]
+        return matches
+
+    def plugin_ids(self,identifiers):
+        """
+        Return set of plugin IDs matching any of the identifiers
+        """
+        plugin_ids = set()
+        for value in self.lookup(identifiers).values():
+            plugin_ids.update(value)
+        return plugin_ids
+
+    def affected_hosts(self,identifiers):
+        """
+        Return set of address:port strings affected by any of identifiers
+        """
+        hosts = set()
+        for plugin_id in self.plugin_ids(identifiers):
+            hosts.update(self.hosts.get(plugin_id,()))
+        return hosts
+
+    def load(self,path):
+        try:
+            fd = open(path,'rb')
+            try:
+                (version,index,hosts,plugins) = cPickle.load(fd)
+            finally:
+                fd.close()
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error reading reference index %s: %s' % (path,emsg))
+        except Exception,e:
+            raise ReportParserError('Invalid reference index %s: %s' % (path,e))
+        if version != REFERENCE_INDEX_VERSION:
+            raise ReportParserError('Unsupported reference index version in %s' % path)
+        self.update(index)
+        self.hosts.update(hosts)
+        self.plugins.update(plugins)
+
+    def save(self,path=None):
+        path = path is not None and path or self.path
+        if path is None:
+            return
+        try:
+            fd = open(path,'wb')
+            try:
+                cPickle.dump(
+                    (REFERENCE_INDEX_VERSION,dict(self),self.hosts,self.plugins),
+                    fd,cPickle.HIGHEST_PROTOCOL
+                )
+            finally:
+                fd.close()
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error writing reference index %s: %s' % (path,emsg))
+
+def read_identifiers(path):
+    """
+    Read identifiers from a file, separated by whitespace or commas. Text
+    after # is ignored.
+    """
+    identifiers = []
+    try:
+        for line in open(path,'r').readlines():
+            identifiers.extend(line.split('#',1)[0].replace(',',' ').split())
+    except (IOError,OSError),(ecode,emsg):
+        raise ReportParserError('Error reading %s: %s' % (path,emsg))
+    return identifiers
+
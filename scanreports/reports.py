@@ -10,7 +10,7 @@ import xlwt,cgi
 
 from scanreports import ReportParserError
 
-DEFAULT_CONFIG_PATH = os.path.join(os.getenv('HOME'),'.scanreports.conf')
+DEFAULT_CONFIG_PATH = os.path.join(os.path.expanduser('~'),'.scanreports.conf')
 DEFAULT_CONFIG = {
     'header': { 'color': '#ffffff', 'background': '#0082C8' },
     'levels': {
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Host name resolution for report parsers. Names are resolved from report
+host properties first, then from a persistent name cache, and finally with
+DNS lookups in worker threads with a timeout, unless offline mode is used.
+"""
+
+import os,socket,threading,logging
+from Queue import Queue,Empty
+
+from scanreports import ReportParserError
+
+DEFAULT_TIMEOUT = 5
+DEFAULT_THREADS = 8
+
+# Host properties containing the scanned address of a host
+ADDRESS_PROPERTIES = ['host-ip']
+
+class HostResolver(dict):
+    """
+    Cache of resolved host names, mapping names to address strings. Failed
+    lookups are cached as None for the lifetime of the resolver.
+    """
+    def __init__(self,cache_path=None,offline=False,timeout=DEFAULT_TIMEOUT,
+                 threads=DEFAULT_THREADS):
+        self.log = logging.getLogger('modules')
+        self.cache_path = cache_path
+        self.offline = offline
+        self.timeout = timeout
+        self.threads = threads
+        self.lock = threading.Lock()
+        self.modified = False
+        if cache_path is not None and os.path.isfile(cache_path):
+            self.load(cache_path)
+
+    def options(self):
+        """
+        Return options to create a resolver with same settings, for example
+        in worker processes
+        """
+        return {
+            'cache_path': self.cache_path,
+            'offline': self.offline,
+            'timeout': self.timeout,
+            'threads': self.threads,
+        }
+
+    def merge(self,names):
+        """
+        Merge names resolved by another resolver
+        """
+        for name,address in names.items():
+            if address is not None and self.get(name) != address:
+                self[name] = address
+                self.modified = True
+            elif name not in self:
+                self[name] = address
+
+    def load(self,path):
+        """
+        Load name cache file with lines 'name address'
+        """
+        try:
+            for line in open(path,'r').readlines():
+                try:
+                    (name,address) = line.split()
+                except ValueError:
+                    continue
+                self[name.lower()] = address
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error reading name cache %s: %s' % (path,emsg))
+
+    def save(self,path=None):
+        """
+        Write resolved names to the name cache file
+        """
+        path = path is not None and path or self.cache_path
+        if path is None or not self.modified:
+            return
+        try:
+            fd = open(path,'w')
+            for name in sorted(self.keys()):
+                if self[name] is not None:
+                    fd.write('%s %s\n' % (name,self[name]))
+            fd.close()
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error writing name cache %s: %s' % (path,emsg))
+        self.modified = False
+
+    def __lookup__(self,name):
+        try:
+            address = socket.gethostbyname(name)
+        except socket.error,e:
+            self.log.debug('Error resolving %s: %s' % (name,e))
+            address = None
+        self.lock.acquire()
+        try:
+            self[name] = address
+            self.modified = self.modified or address is not None
+        finally:
+            self.lock.release()
+
+    def prefetch(self,names):
+        """
+        Resolve given names concurrently in worker threads, waiting at most
+        timeout seconds for the lookups
+        """
+        names = set(name.lower() for name in names).difference(self.keys())
+        if self.offline or not names:
+            return
+
+        self.log.debug('Resolving %d names' % len(names))
+        queue = Queue()
+        for name in names:
+            queue.put(name)
+        # All names are queued before starting, workers exit when it's empty
+        def worker():
+            while True:
+                try:
+                    name = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    self.__lookup__(name)
+                finally:
+                    queue.task_done()
+        for i in range(min(self.threads,len(names))):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+
+        # Queue.join has no timeout, wait for the worker threads with one
+        done = threading.Thread(target=queue.join)
+        done.daemon = True
+        done.start()
+        done.join(self.timeout)
+        self.lock.acquire()
+        try:
+            for name in names:
+                if name not in self:
+                    self.log.debug('Timeout resolving %s' % name)
+                    self[name] = None
+        finally:
+            self.lock.release()
+
+    def resolve(self,name,properties={}):
+        """
+        Return address string for name, or None if it can't be resolved
+        """
+        for key in ADDRESS_PROPERTIES:
+            if properties.get(key):
+                return properties[key]
+        name = name.lower()
+        if name not in self:
+            if self.offline:
+                return None
+            self.prefetch([name])
+        return self.get(name)
+
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Per-host risk rollup of nessus results, computed in one pass over results
+from a NessusResultSet, parsed reports or a streaming parser.
+"""
+
+import decimal
+
+from scanreports.addresslist import address_string,address_value
+
+SEVERITY_LEVELS = range(0,4)
+
+class NessusHostRollup(object):
+    """
+    Aggregates of results for one host
+    """
+    __slots__ = (
+        'address','name','counts','max_cvss','total_cvss','exploitable','cves'
+    )
+
+    def __init__(self,address,name=None):
+        self.address = address
+        self.name = name
+        self.counts = [0 for level in SEVERITY_LEVELS]
+        self.max_cvss = None
+        self.total_cvss = decimal.Decimal(0)
+        self.exploitable = 0
+        self.cves = set()
+
+    def __str__(self):
+        return '%s: %s findings, max CVSS %s, %d exploitable, %d CVEs' % (
+            address_string(self.address),
+            '/'.join(str(c) for c in reversed(self.counts)),
+            self.max_cvss,self.exploitable,len(self.cves)
+        )
+
+    @property
+    def findings(self):
+        return sum(self.counts)
+
+    @property
+    def max_severity(self):
+        for level in reversed(SEVERITY_LEVELS):
+            if self.counts[level]:
+                return level
+        return None
+
+    def add(self,result):
+        """
+        Add a NessusTargetResultItem to the aggregates
+        """
+        if self.name is None and result.host is not None:
+            self.name = result.host.name
+        self.counts[result.severity] += 1
+        score = result.get('cvss_base_score')
+        if score is not None:
+            self.total_cvss += score
+            if self.max_cvss is None or score > self.max_cvss:
+                self.max_cvss = score
+        if result.get('exploit_available',False):
+            self.exploitable += 1
+        cves = result.get('cve')
+        if cves:
+            self.cves.update(cves)
+
+    def sortkey(self):
+        """
+        Sort key ordering hosts by descending risk, then by address
+        """
+        max_severity = self.max_severity
+        if max_severity is None:
+            max_severity = -1
+        return (
+            -max_severity,
+            -self.total_cvss,
+            address_value(self.address),
+        )
+
+class NessusHostRollupTable(dict):
+    """
+    Host rollups by address string
+    """
+    def __init__(self,results=[]):
+        self.load(results)
+
+    def add(self,result):
+        key = address_string(result.address)
+        try:
+            rollup = self[key]
+        except KeyError:
+            rollup = self[key] = NessusHostRollup(result.address)
+        rollup.add(result)
+
+    def load(self,results):
+        """
+        Add results from any iterable of results, or a source with a
+        results() method like NessusXMLStream
+        """
+        if hasattr(results,'results'):
+            results = results.results()
+        for result in results:
+            self.add(result)
+
+    def hosts(self):
+        """
+        Return host rollups ordered by descending risk
+        """
+        return sorted(self.values(),key=lambda h: h.sortkey())
+
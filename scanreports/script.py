@@ -59,6 +59,9 @@ def prepare(argv):
     parser = OptionParser()
     parser.add_option('-v','--verbose',dest='verbose',action='store_true',help='Show verbose messages')
     parser.add_option('-d','--debug',dest='debug',action='store_true',help='Show debug messages')
+    parser.add_option('--cache',action='store_true',help='Cache parsed reports')
+    parser.add_option('--cache-dir',help='Parsed report cache directory')
+    parser.add_option('--cache-size',type='int',help='Parsed report cache size limit in MB')
     return parser
 
 def initialize(parser):
@@ -84,3 +87,15 @@ def initialize(parser):
         pass
     return (opts,args)
 
+def report_cache(opts):
+    """
+    Return ReportCache if cache was requested with options, otherwise None
+    """
+    if not opts.cache and not opts.cache_dir:
+        return None
+    from scanreports.cache import ReportCache,DEFAULT_CACHE_DIR,DEFAULT_CACHE_SIZE
+    return ReportCache(
+        path=opts.cache_dir and opts.cache_dir or DEFAULT_CACHE_DIR,
+        max_size=opts.cache_size and opts.cache_size*2**20 or DEFAULT_CACHE_SIZE,
+    )
+
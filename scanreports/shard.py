@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Split nessus XML reports to smaller shards by ReportHost, and merge results
+processed from the shards back together.
+"""
+
+import os,zlib,logging
+from bisect import bisect_right
+from xml.sax.saxutils import quoteattr
+from lxml import etree
+
+from scanreports import ReportParserError
+from scanreports.addresslist import address_value
+from scanreports.nessus import NessusResultSet,parse_host_address
+from scanreports.nessus import NESSUS_REPORT_FORMATS
+
+SHARD_STRATEGIES = ['hash','range']
+
+def start_tag(node):
+    """
+    Return start tag of node as UTF-8 encoded string
+    """
+    return (u'<%s%s>' % (node.tag,u''.join(
+        u' %s=%s' % (k,quoteattr(v)) for k,v in node.items()
+    ))).encode('utf-8')
+
+def host_address(node):
+    """
+    Return address of ReportHost node from name or host-ip property, None
+    if name is not an address and there is no host-ip property
+    """
+    address = parse_host_address(node.get('name'))
+    if address is None:
+        tag = node.find("HostProperties/tag[@name='host-ip']")
+        if tag is not None and tag.text:
+            address = parse_host_address(tag.text.strip())
+    return address
+
+def host_hash(node):
+    return zlib.crc32((node.get('name') or '').lower()) & 0xffffffff
+
+class NessusShardWriter(object):
+    """
+    Writer for one shard file
+    """
+    def __init__(self,path,root):
+        self.path = path
+        self.report = None
+        self.hosts = 0
+        try:
+            self.fd = open(path,'wb')
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error writing %s: %s' % (path,emsg))
+        self.fd.write('<?xml version="1.0" ?>\n%s\n' % start_tag(root))
+        self.root = root.tag
+
+    def write(self,node):
+        self.fd.write('%s\n' % etree.tostring(node,with_tail=False))
+
+    def write_host(self,report,node):
+        if self.report is not report:
+            if self.report is not None:
+                self.fd.write('</Report>\n')
+            self.fd.write('%s\n' % start_tag(report))
+            self.report = report
+        self.write(node)
+        self.hosts += 1
+
+    def close(self):
+        if self.report is not None:
+            self.fd.write('</Report>\n')
+        self.fd.write('</%s>\n' % self.root)
+        self.fd.close()
+
+class NessusReportSplitter(object):
+    """
+    Streaming splitter of a nessus XML report to shards. Hosts are assigned
+    to shards by hash of the host name, or with range strategy by address
+    ranges with about equal number of hosts in each shard. Range strategy
+    reads the report twice.
+
+    Each shard is a valid nessus report with the policy of the original
+    report and a subset of the hosts.
+    """
+    def __init__(self,path,shards,strategy='hash'):
+        if not os.path.isfile(path):
+            raise ReportParserError('No such file: %s' % path)
+        if shards < 1:
+            raise ReportParserError('Invalid number of shards: %s' % shards)
+        if strategy not in SHARD_STRATEGIES:
+            raise ReportParserError('Invalid shard strategy: %s' % strategy)
+        self.log = logging.getLogger('modules')
+        self.path = path
+        self.shards = shards
+        self.strategy = strategy
+        self.boundaries = None
+
+    def __address_boundaries__(self):
+        """
+        Return sorted address values splitting hosts to shards
+        """
+        values = []
+        try:
+            for (event,node) in etree.iterparse(self.path,tag='ReportHost'):
+                address = host_address(node)
+                if address is not None:
+                    values.append(address_value(address))
+                node.clear()
+        except etree.XMLSyntaxError,e:
+            raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+        values = sorted(set(values))
+        return [values[len(values)*i/self.shards]
+            for i in range(1,self.shards) if values
+        ]
+
+    def shard(self,node):
+        """
+        Return shard number for ReportHost node
+        """
+        if self.boundaries is not None:
+            address = host_address(node)
+            if address is not None:
+                return bisect_right(self.boundaries,address_value(address))
+        return host_hash(node) % self.shards
+
+    def shard_paths(self,directory):
+        name = os.path.basename(self.path)
+        if name.endswith('.nessus'):
+            name = name[:-len('.nessus')]
+        return [os.path.join(directory,'%s-shard%03d.nessus' % (name,i))
+            for i in range(self.shards)
+        ]
+
+    def split(self,directory):
+        """
+        Write shards to directory, returning list of shard file paths
+        """
+        if self.strategy == 'range':
+            self.boundaries = self.__address_boundaries__()
+        paths = self.shard_paths(directory)
+        writers = None
+        report = None
+        try:
+            try:
+                for (event,node) in etree.iterparse(self.path,events=('start','end')):
+                    if event == 'start':
+                        if node.getparent() is None:
+                            if node.tag not in NESSUS_REPORT_FORMATS:
+                                raise ReportParserError(
+                                    'Unsupported nessus report format: %s' % node.tag
+                                )
+                            writers = [NessusShardWriter(path,node) for path in paths]
+                        elif node.tag == 'Report':
+                            report = node
+                        continue
+
+                    if node.tag == 'Policy':
+                        for writer in writers:
+                            writer.write(node)
+                    elif node.tag == 'ReportHost':
+                        writers[self.shard(node)].write_host(report,node)
+                    elif node.tag != 'Report':
+                        continue
+
+                    node.clear()
+                    while node.getprevious() is not None:
+                        del node.getparent()[0]
+
+            except etree.XMLSyntaxError,e:
+                raise ReportParserError('Error parsing %s: %s' % (self.path,e))
+        finally:
+            if writers is not None:
+                for writer in writers:
+                    writer.close()
+
+        for writer in writers:
+            self.log.debug('%s: %d hosts' % (writer.path,writer.hosts))
+        return paths
+
+def merge_result_sets(resultsets,**kwargs):
+    """
+    Merge result sets processed from shards to one NessusResultSet. Keyword
+    arguments are passed to NessusResultSet.
+    """
+    merged = NessusResultSet(**kwargs)
+    merged.load(resultsets,filtered=set())
+    return merged
+
+def merge_counters(counters):
+    """
+    Merge severity counters from NessusResultSet.counters() of shards
+    """
+    merged = {}
+    for values in counters:
+        for severity,count in values.items():
+            merged[severity] = merged.get(severity,0) + count
+    return merged
+
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+Persistent store of nessus results for appending partial reports to a result
+set incrementally. Findings are de-duplicated by address, port and plugin ID,
+and the result from the latest scan of the host is kept.
+"""
+
+import os,time,calendar,shelve,logging,cPickle
+
+from scanreports import ReportParserError
+from scanreports.addresslist import address_string
+from scanreports.cache import file_digest
+from scanreports.nessus import NessusTargetResultItem,NessusPluginDetailsTable
+from scanreports.nessus import REPORT_INSTANCE_FIELDS
+
+# Host properties with scan time of host, in order of preference
+SCAN_TIME_PROPERTIES = ['host_end','host_start']
+SCAN_TIME_FORMAT = '%a %b %d %H:%M:%S %Y'
+
+# Increase when the store format changes
+STORE_FORMAT_VERSION = 2
+
+def host_scan_time(host):
+    """
+    Return scan time of a NessusTargetHost as UNIX timestamp, or None
+    """
+    properties = getattr(host,'properties',None) or {}
+    for key in SCAN_TIME_PROPERTIES:
+        value = properties.get(key)
+        if value is None:
+            continue
+        try:
+            return calendar.timegm(time.strptime(value.strip(),SCAN_TIME_FORMAT))
+        except ValueError:
+            continue
+    return None
+
+def sequence_key(sequence):
+    return 'sequence:%012d' % sequence
+
+class NessusResultStore(object):
+    """
+    Shelve file of nessus results with keys
+
+    result:<address> <port> <pluginID>  (scan time,sequence)
+    sequence:<sequence>                 (result key,result values)
+    plugin:<pluginID>                   NessusPluginDetails
+    file:<digest>                       path of a stored report file
+    sequence                            last sequence number
+    count                               number of stored results
+    version                             STORE_FORMAT_VERSION
+
+    Sequence numbers in keys are zero padded, so sorted keys are in the
+    order results were stored. Stored results are loaded as
+    NessusTargetResultItem objects without the host reference, in the order
+    they were stored.
+    """
+    def __init__(self,path):
+        self.log = logging.getLogger('modules')
+        self.path = path
+        try:
+            self.shelf = shelve.open(path,protocol=cPickle.HIGHEST_PROTOCOL)
+        except Exception,e:
+            raise ReportParserError('Error opening result store %s: %s' % (path,e))
+        self.sequence = self.shelf.get('sequence',0)
+        self.count = self.shelf.get('count',0)
+        version = self.shelf.get('version')
+        if version is None and self.sequence == 0:
+            self.shelf['version'] = version = STORE_FORMAT_VERSION
+        if version != STORE_FORMAT_VERSION:
+            self.shelf.close()
+            raise ReportParserError('Unsupported result store version in %s' % path)
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        return '%s: %d results' % (self.path,len(self))
+
+    def close(self):
+        self.shelf.close()
+
+    def file_key(self,path):
+        try:
+            st = os.stat(path)
+            digest = file_digest(path)
+        except (IOError,OSError),(ecode,emsg):
+            raise ReportParserError('Error reading %s: %s' % (path,emsg))
+        return 'file:%s %s' % (digest,st.st_size)
+
+    def pending(self,paths):
+        """
+        Return paths not yet added to the store
+        """
+        return [path for path in paths if self.file_key(path) not in self.shelf]
+
+    def result_key(self,result):
+        return 'result:%s %s %s' % (
+            address_string(result.address),result.port,result.pluginID
+        )
+
+    def add(self,result,scan_time=None):
+        """
+        Add a result, replacing stored result for same address, port and
+        plugin ID unless the stored result is from a later scan. Results
+        without scan time are considered to be from current time.
+        """
+        if scan_time is None:
+            scan_time = host_scan_time(getattr(result,'host',None))
+        if scan_time is None:
+            scan_time = time.time()
+        key = self.result_key(result)
+        stored = self.shelf.get(key)
+        if stored is not None:
+            if stored[0] > scan_time:
+                return False
+            del self.shelf[sequence_key(stored[1])]
+        else:
+            self.count += 1
+
+        values = {}
+        for field in REPORT_INSTANCE_FIELDS:
+            try:
+                values[field] = object.__getattribute__(result,field)
+            except AttributeError:
+                pass
+        if result.extra:
+            values['extra'] = result.extra
+        self.sequence += 1
+        self.shelf[key] = (scan_time,self.sequence)
+        self.shelf[sequence_key(self.sequence)] = (key,values)
+
+        plugin_key = 'plugin:%s' % result.pluginID
+        stored = self.shelf.get(plugin_key)
+        if stored is None or result.plugin.get('plugin_modification_date',()) > \
+           stored.get('plugin_modification_date',()):
+            self.shelf[plugin_key] = result.plugin
+        return True
+
+    def add_reports(self,reports):
+        """
+        Add results from parsed reports (see NessusResultSet.load) and mark
+        the report files as stored
+        """
+        for source in reports:
+            self.log.debug('Adding to result store: %s' % source)
+            if hasattr(source,'results'):
+                results = source.results()
+            else:
+                results = iter(source)
+            count = 0
+            for r in results:
+                if self.add(r):
+                    count += 1
+            path = getattr(source,'path',None)
+            if path is not None:
+                self.shelf[self.file_key(path)] = path
+            self.log.debug('Stored %d results' % count)
+        self.shelf['sequence'] = self.sequence
+        self.shelf['count'] = self.count
+        self.shelf.sync()
+
+    def results(self):
+        """
+        Iterate stored results
+        """
+        keys = sorted(k for k in self.shelf.keys() if k.startswith('sequence:'))
+        plugins = NessusPluginDetailsTable()
+        for key in keys:
+            (result_key,values) = self.shelf[key]
+            result = NessusTargetResultItem.__new__(NessusTargetResultItem)
+            result.host = None
+            result.extra = values.pop('extra',None)
+            for field,value in values.items():
+                setattr(result,field,value)
+            try:
+                result.plugin = plugins[result.pluginID]
+            except KeyError:
+                result.plugin = plugins.merge(
+                    self.shelf['plugin:%s' % result.pluginID]
+                )
+            yield result
+
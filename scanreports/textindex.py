@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+Trigram index over text fields of nessus results. Regular expression
+searches use the index to find candidate results containing all trigrams
+of the literal strings required by the expression, and run the expression
+only for the candidates.
+"""
+
+import re,sre_parse,sre_constants
+from array import array
+
+from scanreports import ReportParserError
+
+# Text fields stored in each result
+TEXT_INDEX_RESULT_FIELDS = ['plugin_output']
+# Text fields stored in shared plugin details
+TEXT_INDEX_PLUGIN_FIELDS = ['description','synopsis']
+TEXT_INDEX_FIELDS = TEXT_INDEX_RESULT_FIELDS + TEXT_INDEX_PLUGIN_FIELDS
+
+def text_value(value):
+    """
+    Return text field value as a string
+    """
+    if value is None:
+        return None
+    if isinstance(value,(list,tuple)):
+        return '\n'.join(value)
+    return value
+
+def text_pattern(pattern):
+    """
+    Return search pattern as unicode. Byte string patterns, for example from
+    command line, are decoded as UTF-8 to match the parsed text fields.
+    """
+    if isinstance(pattern,unicode):
+        return pattern
+    try:
+        return pattern.decode('utf-8')
+    except UnicodeDecodeError,e:
+        raise ReportParserError('Invalid search pattern %s: %s' % (pattern,e))
+
+def trigrams(text):
+    """
+    Return set of lowercase trigrams in text
+    """
+    text = text.lower()
+    return set(text[i:i+3] for i in xrange(len(text)-2))
+
+def required_literals(pattern,flags=0):
+    """
+    Return list of literal strings any match of regular expression pattern
+    compiled with flags must contain. Alternatives and repeats are not
+    analyzed, so the list may be empty.
+    """
+    pattern = text_pattern(pattern)
+    literals = []
+    current = []
+    def walk(items):
+        for (op,av) in items:
+            if op == sre_constants.LITERAL:
+                current.append(unichr(av))
+            elif op == sre_constants.SUBPATTERN:
+                walk(av[-1])
+            else:
+                if current:
+                    literals.append(u''.join(current))
+                del current[:]
+    try:
+        walk(sre_parse.parse(pattern,flags))
+    except (sre_constants.error,ValueError),e:
+        raise ReportParserError('Invalid search pattern %s: %s' % (pattern,e))
+    if current:
+        literals.append(u''.join(current))
+    return literals
+
+class TextPostings(dict):
+    """
+    Postings of trigrams to sorted arrays of document numbers
+    """
+    def add(self,document,text):
+        for trigram in trigrams(text):
+            try:
+                postings = self[trigram]
+            except KeyError:
+                postings = self[trigram] = array('l')
+            if not postings or postings[-1] != document:
+                postings.append(document)
+
+    def candidates(self,literals):
+        """
+        Return set of documents containing all trigrams of literals, or
+        None if the literals have no trigrams
+        """
+        required = set()
+        for literal in literals:
+            required.update(trigrams(literal))
+        if not required:
+            return None
+        documents = None
+        # Intersect from the shortest postings
+        for trigram in sorted(required,key=lambda t: len(self.get(t,()))):
+            postings = self.get(trigram)
+            if not postings:
+                return set()
+            if documents is None:
+                documents = set(postings)
+            else:
+                documents.intersection_update(postings)
+            if not documents:
+                break
+        return documents
+
+class NessusTextIndex(object):
+    """
+    Trigram index of text fields in nessus results. Result fields are indexed
+    by result number, plugin detail fields once for each plugin ID.
+
+    An index returned by subset() shares the postings and is limited to the
+    result numbers in members. Results can't be added to it.
+    """
+    def __init__(self,fields=TEXT_INDEX_FIELDS):
+        for field in fields:
+            if field not in TEXT_INDEX_FIELDS:
+                raise ReportParserError('Unsupported text index field: %s' % field)
+        self.fields = fields
+        self.results = []
+        self.documents = {}
+        self.members = None
+        self.plugin_results = {}
+        self.postings = dict((field,TextPostings()) for field in fields)
+
+    def __len__(self):
+        if self.members is not None:
+            return len(self.members)
+        return len(self.results)
+
+    def subset(self,results):
+        """
+        Return index limited to given results, which must be indexed
+        """
+        index = NessusTextIndex.__new__(NessusTextIndex)
+        index.__dict__.update(self.__dict__)
+        index.members = set(self.documents[id(r)] for r in results)
+        return index
+
+    def add(self,result):
+        if self.members is not None:
+            raise ReportParserError('Results can not be added to an index subset')
+        document = len(self.results)
+        self.results.append(result)
+        self.documents[id(result)] = document
+        plugin_id = result.pluginID
+        new_plugin = plugin_id not in self.plugin_results
+        try:
+            self.plugin_results[plugin_id].append(document)
+        except KeyError:
+            self.plugin_results[plugin_id] = [document]
+
+        for field in self.fields:
+            if field in TEXT_INDEX_PLUGIN_FIELDS:
+                if not new_plugin:
+                    continue
+                key = plugin_id
+            else:
+                key = document
+            value = text_value(result.get(field))
+            if value:
+                self.postings[field].add(key,value)
+
+    def candidates(self,pattern,fields=None,flags=0):
+        """
+        Return sorted list of result numbers possibly matching pattern
+        compiled with flags in any of given fields
+        """
+        fields = fields is not None and fields or self.fields
+        pattern = text_pattern(pattern)
+        literals = required_literals(pattern,flags)
+        documents = set()
+        for field in fields:
+            if field not in self.postings:
+                raise ReportParserError('Field is not indexed: %s' % field)
+            matches = self.postings[field].candidates(literals)
+            if matches is None:
+                documents = None
+                break
+            if field in TEXT_INDEX_PLUGIN_FIELDS:
+                for plugin_id in matches:
+                    documents.update(self.plugin_results.get(plugin_id,()))
+            else:
+                documents.update(matches)
+        if documents is None:
+            if self.members is not None:
+                return sorted(self.members)
+            return range(len(self.results))
+        if self.members is not None:
+            documents.intersection_update(self.members)
+        return sorted(documents)
+
+    def search(self,pattern,fields=None,flags=0):
+        """
+        Return results where regular expression pattern matches any of
+        given fields, in indexed order
+        """
+        fields = fields is not None and fields or self.fields
+        pattern = text_pattern(pattern)
+        try:
+            expression = re.compile(pattern,flags|re.UNICODE)
+        except re.error,e:
+            raise ReportParserError('Invalid search pattern %s: %s' % (pattern,e))
+        results = []
+        for document in self.candidates(pattern,fields,flags):
+            result = self.results[document]
+            for field in fields:
+                value = text_value(result.get(field))
+                if value and expression.search(value):
+                    results.append(result)
+                    break
+        return results
+